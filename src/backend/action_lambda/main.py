@@ -5,6 +5,7 @@ from datetime import datetime
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import TextSendMessage, QuickReply, QuickReplyButton, MessageAction
 from firebase_admin import initialize_app, firestore
+from src.backend.common import aggregates
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -33,6 +34,7 @@ def handle_postback(event):
         
         # レビューステータスを更新
         review_ref.update({'status': 'posted'})
+        aggregates.record_status_change(review.get('locationId'), review.get('status'), 'posted')
         
         # コピー用のテキストを送信
         line_bot_api.reply_message(
@@ -66,6 +68,7 @@ def handle_postback(event):
     elif action == 'SKIP':
         # 無視ボタンが押された場合
         review_ref.update({'status': 'ignored'})
+        aggregates.record_status_change(review.get('locationId'), review.get('status'), 'ignored')
         
         line_bot_api.reply_message(
             event.reply_token,
@@ -0,0 +1,125 @@
+import os
+import random
+from collections import Counter
+from datetime import datetime
+from firebase_admin import firestore
+
+# 書き込みを分散するシャード数（1ロケーションあたり約1書き込み/秒/シャードが上限）
+SHARD_COUNT = int(os.environ.get('LOCATION_STATS_SHARDS', '10'))
+
+def _stats_ref(location_id):
+    """ロケーションの集計ドキュメントを取得"""
+    return firestore.client().collection('location_stats').document(location_id)
+
+def _to_increments(values):
+    """0の値と空になったマップを除いてIncrementに変換"""
+    increments = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            nested = _to_increments(value)
+            # 空のマップをmerge付きで書き込むと既存のフィールドが消えるため除外する
+            if nested:
+                increments[key] = nested
+        elif value:
+            increments[key] = firestore.Increment(value)
+    return increments
+
+def _increment(location_id, counts):
+    """ランダムに選んだシャードに集計値を加算（countsはネストした辞書）"""
+    increments = _to_increments(counts)
+    if not increments:
+        return
+
+    shard_ref = _stats_ref(location_id).collection('shards').document(
+        str(random.randrange(SHARD_COUNT))
+    )
+    # 集計ドキュメントの更新要否を判定するため、シャードの最終更新時刻も記録する
+    shard_ref.set({**increments, 'updatedAt': firestore.SERVER_TIMESTAMP}, merge=True)
+
+def rating_key(rating):
+    """評価分布のキーを作成"""
+    return str(rating) if rating is not None else 'unknown'
+
+def month_key(timestamp=None):
+    """月別集計のキーを作成"""
+    return (timestamp or datetime.utcnow()).strftime('%Y-%m')
+
+def record_reviews(location_id, review_docs):
+    """保存したレビューの件数・評価分布・ステータス別件数を加算"""
+    review_docs = list(review_docs)
+    if not review_docs:
+        return
+    _increment(location_id, {
+        'reviews': len(review_docs),
+        'ratings': dict(Counter(rating_key(doc.get('rating')) for doc in review_docs)),
+        'statuses': dict(Counter(doc.get('status', 'new') for doc in review_docs))
+    })
+
+def record_status_change(location_id, old_status, new_status):
+    """レビューのステータス変更をステータス別件数に反映"""
+    if not location_id or old_status == new_status:
+        return
+    statuses = {new_status: 1}
+    if old_status:
+        statuses[old_status] = -1
+    _increment(location_id, {'statuses': statuses})
+
+def record_draft(location_id, token_usage, created_at=None):
+    """ドラフト件数とOpenAIトークン使用量を月別に加算"""
+    month = month_key(created_at)
+    _increment(location_id, {
+        'drafts': {month: 1},
+        'tokens': {month: token_usage}
+    })
+
+def _merge_counts(total, values):
+    """シャードの値を合計に加算"""
+    for key, value in values.items():
+        if isinstance(value, dict):
+            _merge_counts(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+def _sum_shards(location_id):
+    """全シャードの合計と、シャードの最終更新時刻を取得"""
+    stats = {'reviews': 0, 'ratings': {}, 'statuses': {}, 'drafts': {}, 'tokens': {}}
+    last_updated = None
+    for shard in _stats_ref(location_id).collection('shards').stream():
+        values = shard.to_dict()
+        updated_at = values.pop('updatedAt', None)
+        if updated_at is not None and (last_updated is None or updated_at > last_updated):
+            last_updated = updated_at
+        _merge_counts(stats, values)
+    return stats, last_updated
+
+def get_location_stats(location_id):
+    """全シャードを合計してロケーションの最新の集計値を取得（読み取りはシャード数分）"""
+    return _sum_shards(location_id)[0]
+
+def has_unrolled_changes(location_id):
+    """前回の集計以降に更新されたシャードがあるかを判定（変更がなければ2回の読み取りで済む）"""
+    summary = _stats_ref(location_id).get()
+    rolled_up_at = summary.to_dict().get('shardsUpdatedAt') if summary.exists else None
+    if rolled_up_at is None:
+        return True
+    changed = _stats_ref(location_id).collection('shards') \
+        .where('updatedAt', '>', rolled_up_at).limit(1).stream()
+    return any(True for _ in changed)
+
+def rollup_location_stats(location_id, only_if_changed=True):
+    """シャードの合計を集計ドキュメントに書き込み、ダッシュボードは1ドキュメントで読めるようにする
+
+    生成・通知・LINE操作による更新は、次にこの関数が呼ばれるまで（通常は次回の
+    定期取り込みまで）集計ドキュメントに反映されない。最新値が必要な場合は
+    get_location_stats を使う。
+    """
+    if only_if_changed and not has_unrolled_changes(location_id):
+        return None
+    stats, last_updated = _sum_shards(location_id)
+    _stats_ref(location_id).set({
+        **stats,
+        'shardsUpdatedAt': last_updated,
+        'updatedAt': datetime.utcnow()
+    })
+    return stats
@@ -0,0 +1,352 @@
+import os
+import re
+import time
+import zlib
+import random
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import timedelta
+from firebase_admin import firestore
+
+logger = logging.getLogger(__name__)
+
+# MinHash / LSH設定（32個のハッシュを4個ずつ8バンドに分割、候補の閾値は類似度約0.6）
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# 推定類似度がこの値以上なら重複とみなす
+DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD', '0.8'))
+# これより短いコメント（「美味しかった」など）は正当な重複が多いため判定しない
+MIN_TEXT_LENGTH = int(os.environ.get('DUPLICATE_MIN_TEXT_LENGTH', '20'))
+
+# インデックスの保存設定（1チャンク約0.6MBでFirestoreのドキュメント上限1MiBに収める）
+CHUNK_SIZE = 4000
+CHUNK_READ_BATCH = 10
+# 未圧縮の署名ログがこの件数を超えたらチャンクに圧縮する
+COMPACT_THRESHOLD = int(os.environ.get('DUPLICATE_COMPACT_THRESHOLD', '5000'))
+# キャッシュしたインデックスに他インスタンスの追加分を取り込む間隔と、使われないインデックスの保持期間
+REFRESH_SECONDS = float(os.environ.get('DUPLICATE_INDEX_REFRESH_SECONDS', '60'))
+INDEX_TTL_SECONDS = float(os.environ.get('DUPLICATE_INDEX_TTL_SECONDS', '3600'))
+MAX_CACHED_TENANTS = int(os.environ.get('DUPLICATE_MAX_CACHED_TENANTS', '20'))
+# サーバータイムスタンプの確定順のずれを吸収するため、差分取得は少し前から読み直す
+REFRESH_OVERLAP = timedelta(seconds=30)
+
+# ハッシュ関数 h(x) = (a * x + b) mod p の係数（プロセス間で同じ署名になるよう固定シード）
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240101)
+_COEFFICIENTS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+def normalize_text(text):
+    """全角・半角や大文字小文字、空白・記号の違いを吸収"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    return re.sub(r'[\s\W_]+', '', text)
+
+def shingles(text, size=SHINGLE_SIZE):
+    """文字単位のシングル（n-gram）のハッシュ集合を作成"""
+    if len(text) <= size:
+        return {zlib.crc32(text.encode('utf-8'))}
+    return {zlib.crc32(text[i:i + size].encode('utf-8')) for i in range(len(text) - size + 1)}
+
+def minhash_signature(text):
+    """テキストのMinHash署名を作成（正規化後に短すぎる場合はNone）"""
+    text = normalize_text(text)
+    if len(text) < MIN_TEXT_LENGTH:
+        return None
+    hashes = shingles(text)
+    return array('I', (
+        min((a * h + b) % _PRIME for h in hashes) & 0xFFFFFFFF
+        for a, b in _COEFFICIENTS
+    ))
+
+def _band_keys(signature):
+    """署名をバンドごとの64ビットのバケットキーに変換"""
+    return [
+        hash(tuple(signature[band * ROWS:(band + 1) * ROWS])) & 0xFFFFFFFFFFFFFFFF
+        for band in range(BANDS)
+    ]
+
+def _id_key(review_id):
+    """レビューIDの64ビットのキー"""
+    return int.from_bytes(hashlib.blake2b(review_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def _sorted_arrays(keys, rows):
+    """キーの昇順に並べ替えたキー・行の配列を作成（タプルのリストを作らない）"""
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return array('Q', (keys[i] for i in order)), array('I', (rows[i] for i in order))
+
+class _BandTable:
+    """1バンド分のバケット。ソート済み配列と未マージの追加分で保持する"""
+
+    def __init__(self, keys=None, rows=None):
+        self.keys = keys if keys is not None else array('Q')
+        self.rows = rows if rows is not None else array('I')
+        self.pending = {}
+
+    @classmethod
+    def build(cls, keys, rows):
+        return cls(*_sorted_arrays(keys, rows))
+
+    def add(self, key, row):
+        self.pending.setdefault(key, []).append(row)
+        # 追加分が一定量たまったらソート済み配列にまとめる
+        if len(self.pending) >= max(4096, len(self.keys) // 8):
+            self.merge()
+
+    def merge(self):
+        keys, rows = array('Q', self.keys), array('I', self.rows)
+        for key, pending_rows in self.pending.items():
+            for row in pending_rows:
+                keys.append(key)
+                rows.append(row)
+        self.keys, self.rows = _sorted_arrays(keys, rows)
+        self.pending = {}
+
+    def lookup(self, key):
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            yield self.rows[i]
+            i += 1
+        yield from self.pending.get(key, ())
+
+class MinHashIndex:
+    """配列で保持するMinHash署名のLSHインデックス（テナントごとに1つ）
+
+    行は追加順に振られ、並べ替えや削除はしない。チャンクへの保存もこの順序で行う。
+    """
+
+    def __init__(self, threshold=DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.review_ids = []
+        self.signatures = array('I')
+        self.clusters = array('I')
+        self.tables = [_BandTable() for _ in range(BANDS)]
+        self.id_table = _BandTable()
+
+    def __len__(self):
+        return len(self.review_ids)
+
+    @classmethod
+    def from_signatures(cls, review_ids, signatures, clusters=None, threshold=DUPLICATE_THRESHOLD):
+        """署名の一括読み込み（バンドごとに配列を1回だけ並べ替える）"""
+        index = cls(threshold=threshold)
+        index.review_ids = list(review_ids)
+        index.signatures = array('I', signatures)
+        count = len(index.review_ids)
+        index.clusters = array('I', clusters if clusters is not None else range(count))
+        rows = array('I', range(count))
+
+        for band in range(BANDS):
+            start, end = band * ROWS, (band + 1) * ROWS
+            keys = array('Q', (
+                hash(tuple(index.signatures[row * NUM_PERM + start:row * NUM_PERM + end]))
+                & 0xFFFFFFFFFFFFFFFF
+                for row in range(count)
+            ))
+            index.tables[band] = _BandTable.build(keys, rows)
+        index.id_table = _BandTable.build(
+            array('Q', (_id_key(review_id) for review_id in index.review_ids)), rows
+        )
+        return index
+
+    def row_of(self, review_id):
+        """レビューIDの行番号（未登録ならNone）"""
+        for row in self.id_table.lookup(_id_key(review_id)):
+            if self.review_ids[row] == review_id:
+                return row
+        return None
+
+    def similarity(self, signature, row):
+        """保存済み署名との推定Jaccard類似度"""
+        stored = self.signatures[row * NUM_PERM:(row + 1) * NUM_PERM]
+        return sum(1 for a, b in zip(signature, stored) if a == b) / NUM_PERM
+
+    def query(self, signature):
+        """最も類似した既存の署名を(行, 類似度)で返す（閾値未満ならNone）"""
+        best = None
+        seen = set()
+        for band, key in enumerate(_band_keys(signature)):
+            for row in self.tables[band].lookup(key):
+                if row in seen:
+                    continue
+                seen.add(row)
+                score = self.similarity(signature, row)
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (row, score)
+        return best
+
+    def add(self, review_id, signature, cluster_row=None):
+        """署名を追加して行番号を返す（cluster_rowは代表レビューの行）"""
+        row = len(self.review_ids)
+        self.review_ids.append(review_id)
+        self.signatures.extend(signature)
+        self.clusters.append(row if cluster_row is None else cluster_row)
+        for band, key in enumerate(_band_keys(signature)):
+            self.tables[band].add(key, row)
+        self.id_table.add(_id_key(review_id), row)
+        return row
+
+    def cluster_id(self, row):
+        """行が属するクラスタの代表レビューID"""
+        return self.review_ids[self.clusters[row]]
+
+def _index_ref(tenant_id):
+    """テナントのインデックス保存先（チャンクのメタデータ）"""
+    return firestore.client().collection('minhash_index').document(tenant_id)
+
+def _unpack(blob):
+    """保存した署名のバイト列を配列に戻す"""
+    signature = array('I')
+    signature.frombytes(blob)
+    return signature
+
+def _apply_signature_log(index, tenant_id, since=None):
+    """署名ログ（1レビュー1ドキュメント）のうち未反映の分をインデックスに追加
+
+    テナントIDとcreatedAtの複合インデックスが必要。戻り値は(追加件数, 最新のcreatedAt)。
+    """
+    query = firestore.client().collection('minhash_signatures').where('tenantId', '==', tenant_id)
+    if since is not None:
+        query = query.where('createdAt', '>', since - REFRESH_OVERLAP)
+    applied, last_seen = 0, since
+    for doc in query.order_by('createdAt').stream():
+        data = doc.to_dict()
+        created_at = data.get('createdAt')
+        if created_at is not None and (last_seen is None or created_at > last_seen):
+            last_seen = created_at
+        if index.row_of(doc.id) is not None:
+            continue
+        cluster_row = index.row_of(data.get('clusterId', doc.id))
+        index.add(doc.id, _unpack(data['signature']), cluster_row)
+        applied += 1
+    return applied, last_seen
+
+def load_tenant_index(tenant_id):
+    """チャンクに圧縮済みの署名と、それ以降の署名ログからテナントのインデックスを作成
+
+    読み取りはチャンク数（約4,000署名ごとに1ドキュメント）と未圧縮のログ件数分。
+    """
+    client = firestore.client()
+    meta = _index_ref(tenant_id).get()
+    meta = meta.to_dict() if meta.exists else {}
+    chunk_ids = meta.get('chunks', [])
+    chunks_ref = _index_ref(tenant_id).collection('chunks')
+
+    review_ids, signatures, clusters = [], array('I'), array('I')
+    # get_allは順序を保証しないため、少しずつ読んでメタデータの順に連結する
+    for start in range(0, len(chunk_ids), CHUNK_READ_BATCH):
+        batch_ids = chunk_ids[start:start + CHUNK_READ_BATCH]
+        chunks = {
+            chunk.id: chunk.to_dict()
+            for chunk in client.get_all([chunks_ref.document(chunk_id) for chunk_id in batch_ids])
+        }
+        for chunk_id in batch_ids:
+            data = chunks[chunk_id]
+            review_ids.extend(data['reviewIds'].split('\n'))
+            signatures.frombytes(data['signatures'])
+            clusters.frombytes(data['clusters'])
+
+    index = MinHashIndex.from_signatures(review_ids, signatures, clusters)
+    del review_ids, signatures, clusters
+    applied, last_seen = _apply_signature_log(index, tenant_id, meta.get('compactedAt'))
+    if applied >= COMPACT_THRESHOLD:
+        save_tenant_snapshot(tenant_id, index, chunk_ids, meta.get('count', 0), last_seen)
+    return index, last_seen
+
+def save_tenant_snapshot(tenant_id, index, chunk_ids, compacted_count, compacted_at):
+    """チャンク化されていない行を新しいチャンクとして保存し、メタデータに追加
+
+    チャンクは上書きせず毎回別のIDで書き込むため、複数のインスタンスが同時に圧縮しても
+    メタデータは常にいずれか一方の整合したチャンク列を指す（負けた側のチャンクは参照されない）。
+    """
+    chunks_ref = _index_ref(tenant_id).collection('chunks')
+    chunk_ids = list(chunk_ids)
+    token = os.urandom(4).hex()
+    for start in range(compacted_count, len(index), CHUNK_SIZE):
+        end = min(start + CHUNK_SIZE, len(index))
+        chunk_id = f'{start:09d}-{token}'
+        chunks_ref.document(chunk_id).set({
+            'reviewIds': '\n'.join(index.review_ids[start:end]),
+            'signatures': index.signatures[start * NUM_PERM:end * NUM_PERM].tobytes(),
+            'clusters': index.clusters[start:end].tobytes()
+        })
+        chunk_ids.append(chunk_id)
+    # チャンクを書き終えてからメタデータを更新する
+    _index_ref(tenant_id).set({
+        'chunks': chunk_ids,
+        'count': len(index),
+        'compactedAt': compacted_at
+    })
+    logger.info(f"Compacted {len(index) - compacted_count} signatures for tenant {tenant_id}")
+
+# テナントごとのインデックス（関数インスタンス内でLRUキャッシュ）
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+def get_tenant_index(tenant_id):
+    """テナントのインデックスを取得（一定間隔で他インスタンスの追加分を取り込む）"""
+    now = time.time()
+    for cached_tenant, entry in list(_indexes.items()):
+        if now - entry['used_at'] > INDEX_TTL_SECONDS:
+            del _indexes[cached_tenant]
+
+    entry = _indexes.get(tenant_id)
+    if entry is None:
+        index, last_seen = load_tenant_index(tenant_id)
+        entry = {'index': index, 'last_seen': last_seen, 'refreshed_at': now}
+        _indexes[tenant_id] = entry
+    elif now - entry['refreshed_at'] > REFRESH_SECONDS:
+        _, last_seen = _apply_signature_log(entry['index'], tenant_id, entry['last_seen'])
+        entry['last_seen'] = last_seen
+        entry['refreshed_at'] = now
+
+    entry['used_at'] = now
+    _indexes.move_to_end(tenant_id)
+    while len(_indexes) > MAX_CACHED_TENANTS:
+        _indexes.popitem(last=False)
+    return entry['index']
+
+def find_duplicate(tenant_id, review_id, text):
+    """近似重複を判定して署名を登録し、重複なら代表レビューの情報を返す"""
+    signature = minhash_signature(text)
+    if signature is None:
+        return None
+
+    with _lock:
+        index = get_tenant_index(tenant_id)
+        row = index.row_of(review_id)
+        if row is not None:
+            # 再取り込みされた登録済みのレビューは追加せず、登録済みの判定結果を返す
+            cluster_row = index.clusters[row]
+            if cluster_row == row:
+                return None
+            return {
+                'duplicateOf': index.review_ids[cluster_row],
+                'clusterId': index.review_ids[cluster_row],
+                'similarity': index.similarity(signature, cluster_row)
+            }
+
+        match = index.query(signature)
+        cluster_row = index.clusters[match[0]] if match else None
+        row = index.add(review_id, signature, cluster_row)
+        cluster_id = index.cluster_id(row)
+
+    firestore.client().collection('minhash_signatures').document(review_id).set({
+        'tenantId': tenant_id,
+        'signature': signature.tobytes(),
+        'clusterId': cluster_id,
+        'createdAt': firestore.SERVER_TIMESTAMP
+    })
+
+    if not match:
+        return None
+    return {
+        'duplicateOf': index.review_ids[match[0]],
+        'clusterId': cluster_id,
+        'similarity': match[1]
+    }
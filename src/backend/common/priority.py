@@ -0,0 +1,272 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from google.cloud import pubsub_v1
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# レーンごとの重み（大きいほど多く取り出す）
+LANE_WEIGHTS = {'urgent': 6, 'normal': 3, 'low': 1}
+# この秒数以上待っているメッセージは重みに関係なく優先する（飢餓防止）
+MAX_WAIT_SECONDS = float(os.environ.get('PRIORITY_MAX_WAIT_SECONDS', '300'))
+# 1回のドレインで取得する最大メッセージ数（レーンの重みで配分）
+DRAIN_BATCH_SIZE = int(os.environ.get('PRIORITY_DRAIN_BATCH_SIZE', '20'))
+# 処理中のメッセージのACK期限（秒）。期限の半分ごとに延長する
+ACK_DEADLINE_SECONDS = int(os.environ.get('PRIORITY_ACK_DEADLINE_SECONDS', '60'))
+# レーン別トピック（review-queue-urgent など）への公開を有効にするか。
+# 無効の間は review-queue / draft-queue に公開し、プッシュ起動の main で処理する（draft-queue は
+# push_lambda の main をトリガーするサブスクリプションとあわせて作成が必要）。
+# 有効にする前にレーン別のトピックと、プル型サブスクリプション generate-<lane> / push-<lane>
+# を作成し、generate_lambda・push_lambda の drain_main をCloud Schedulerから起動する。
+LANES_ENABLED = os.environ.get('PRIORITY_LANES_ENABLED', 'false').lower() == 'true'
+
+# 低評価でなくても優先して対応すべき否定的なキーワード
+NEGATIVE_KEYWORDS = (
+    '最悪', '二度と', 'ひどい', '酷い', '不快', '失礼', '汚い', '不潔',
+    '返金', 'クレーム', '怒', '残念', 'がっかり',
+    'worst', 'terrible', 'rude', 'dirty', 'refund', 'never again'
+)
+
+def classify_review(review):
+    """評価とコメントからレビューの優先レーンを判定"""
+    rating = review.get('rating')
+    comment = (review.get('comment') or '').lower()
+    has_negative_keyword = any(keyword in comment for keyword in NEGATIVE_KEYWORDS)
+
+    if rating is not None and rating <= 2:
+        return 'urgent'
+    if has_negative_keyword:
+        return 'urgent' if rating is None or rating <= 3 else 'normal'
+    if rating is None or rating == 3:
+        return 'normal'
+    return 'low'
+
+def lane_name(base, lane):
+    """レーンごとのトピック名・サブスクリプション名を作成"""
+    return f'{base}-{lane}'
+
+def topic_name(base, lane):
+    """公開先のトピック名（レーンが無効の間はレーンなしのトピック）"""
+    return lane_name(base, lane) if LANES_ENABLED else base
+
+class LaneScheduler:
+    """レーンごとのキューから重み付き公平スケジューリングで取り出すスケジューラ"""
+
+    def __init__(self, weights=None, max_wait=MAX_WAIT_SECONDS, clock=time.time):
+        self.weights = weights or LANE_WEIGHTS
+        self.max_wait = max_wait
+        self.clock = clock
+        self._queues = {lane: deque() for lane in self.weights}
+        self._credits = {lane: 0 for lane in self.weights}
+        # 最優先レーンは重みで十分に取り出されるため、待ち時間による優先は下位レーンのみに適用する
+        self._top_lane = max(self.weights, key=self.weights.get)
+        # 最優先レーンの順番を待ち時間で奪うのは、この回数の取り出しにつき1回まで
+        self._aging_interval = sum(self.weights.values())
+        self._since_aged = self._aging_interval
+        self._latency = {lane: {'count': 0, 'total': 0.0, 'max': 0.0} for lane in self.weights}
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def push(self, lane, item, enqueued_at=None):
+        """アイテムをレーンに追加（enqueued_atは取り込み時刻のUNIX秒）"""
+        self._queues[lane].append((enqueued_at if enqueued_at is not None else self.clock(), item))
+
+    def _next_lane(self):
+        """次に取り出すレーンを選択"""
+        now = self.clock()
+        starving = [
+            (queue[0][0], lane) for lane, queue in self._queues.items()
+            if lane != self._top_lane and queue and now - queue[0][0] >= self.max_wait
+        ]
+        if starving and self._since_aged >= self._aging_interval:
+            self._since_aged = 0
+            return min(starving)[1]
+
+        # 空でないレーンの間でスムーズ重み付きラウンドロビン
+        active = [lane for lane, queue in self._queues.items() if queue]
+        if not active:
+            return None
+        total_weight = sum(self.weights[lane] for lane in active)
+        for lane in active:
+            self._credits[lane] += self.weights[lane]
+        lane = max(active, key=lambda name: self._credits[name])
+        self._credits[lane] -= total_weight
+
+        # 下位レーンの順番は最も長く待っているレーンに回す（最優先レーンとの順序は変えない）
+        if starving and lane != self._top_lane:
+            self._since_aged = 0
+            return min(starving)[1]
+        self._since_aged += 1
+        return lane
+
+    def pop(self):
+        """次のアイテムを(レーン, アイテム, 取り込み時刻)で取り出す"""
+        lane = self._next_lane()
+        if lane is None:
+            raise IndexError('pop from empty LaneScheduler')
+        enqueued_at, item = self._queues[lane].popleft()
+        return lane, item, enqueued_at
+
+    def record_latency(self, lane, enqueued_at):
+        """取り込みから処理完了までの時間をレーンごとに記録"""
+        latency = max(0.0, self.clock() - enqueued_at)
+        stats = self._latency[lane]
+        stats['count'] += 1
+        stats['total'] += latency
+        stats['max'] = max(stats['max'], latency)
+
+    def metrics(self):
+        """レーンごとの処理件数と待ち時間（平均・最大）を取得"""
+        return {
+            lane: {
+                'count': stats['count'],
+                'avg_latency': stats['total'] / stats['count'] if stats['count'] else 0.0,
+                'max_latency': stats['max']
+            }
+            for lane, stats in self._latency.items()
+        }
+
+def message_enqueued_at(message):
+    """Pub/Subメッセージの取り込み時刻（UNIX秒）を取得"""
+    queued_at = message.attributes.get('queued_at')
+    if queued_at:
+        return float(queued_at)
+    return message.publish_time.timestamp()
+
+class _LeaseExtender:
+    """処理待ち・処理中のメッセージのACK期限を定期的に延長するバックグラウンドスレッド"""
+
+    def __init__(self, subscriber, subscription_paths, deadline=ACK_DEADLINE_SECONDS):
+        self.subscriber = subscriber
+        self.subscription_paths = subscription_paths
+        self.deadline = deadline
+        self._ack_ids = {lane: set() for lane in subscription_paths}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def add(self, lane, ack_id):
+        with self._lock:
+            self._ack_ids[lane].add(ack_id)
+
+    def release(self, lane, ack_id):
+        with self._lock:
+            self._ack_ids[lane].discard(ack_id)
+
+    def extend(self):
+        """保持中の全メッセージのACK期限を延長"""
+        with self._lock:
+            leases = {lane: list(ack_ids) for lane, ack_ids in self._ack_ids.items() if ack_ids}
+        for lane, ack_ids in leases.items():
+            try:
+                self.subscriber.modify_ack_deadline(request={
+                    'subscription': self.subscription_paths[lane],
+                    'ack_ids': ack_ids,
+                    'ack_deadline_seconds': self.deadline
+                })
+            except Exception as e:
+                logger.error(f"Error extending {lane} leases: {str(e)}")
+
+    def _run(self):
+        while not self._stopped.wait(self.deadline / 2):
+            self.extend()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+def drain_lanes(subscription_base, handler, batch_size=DRAIN_BATCH_SIZE, scheduler=None):
+    """各レーンのサブスクリプションからメッセージを取得し、重み付き公平に処理する
+
+    重みで配分した件数を取得した後、空のレーンの残り枠はまだメッセージが残っているレーンに回す。
+    処理待ちのメッセージのACK期限はバックグラウンドで延長し、失敗したメッセージは即時に再配信させる。
+    """
+    subscriber = pubsub_v1.SubscriberClient()
+    if scheduler is None:
+        scheduler = LaneScheduler()
+    subscription_paths = {
+        lane: subscriber.subscription_path(
+            os.environ['GOOGLE_CLOUD_PROJECT'],
+            lane_name(subscription_base, lane)
+        )
+        for lane in scheduler.weights
+    }
+    leases = _LeaseExtender(subscriber, subscription_paths)
+
+    def pull(lane, max_messages):
+        response = subscriber.pull(request={
+            'subscription': subscription_paths[lane],
+            'max_messages': max_messages
+        })
+        for received in response.received_messages:
+            leases.add(lane, received.ack_id)
+            scheduler.push(lane, received, enqueued_at=message_enqueued_at(received.message))
+        return len(response.received_messages)
+
+    # 重みで配分して取得（低優先レーンも毎回最低1件は取得する）
+    total_weight = sum(scheduler.weights.values())
+    remaining = batch_size
+    candidates = []
+    for lane, weight in scheduler.weights.items():
+        max_messages = max(1, batch_size * weight // total_weight)
+        pulled = pull(lane, max_messages)
+        remaining -= pulled
+        if pulled == max_messages:
+            candidates.append(lane)
+
+    # 取得数が上限に達したレーンにはまだ残っている可能性があるため、残り枠を重みで配分して再取得
+    while remaining > 0 and candidates:
+        candidate_weight = sum(scheduler.weights[lane] for lane in candidates)
+        refilled = []
+        for lane in candidates:
+            if remaining <= 0:
+                break
+            max_messages = min(remaining, max(1, remaining * scheduler.weights[lane] // candidate_weight))
+            pulled = pull(lane, max_messages)
+            remaining -= pulled
+            if pulled == max_messages:
+                refilled.append(lane)
+        candidates = refilled
+
+    # 取得に時間がかかった場合に備えて処理前に一度延長する
+    leases.extend()
+    leases.start()
+    try:
+        while len(scheduler):
+            lane, received, enqueued_at = scheduler.pop()
+            try:
+                handler(received.message)
+            except Exception as e:
+                logger.error(f"Error handling {lane} message {received.message.message_id}: {str(e)}")
+                # ACK期限を0にして期限切れを待たずに再配信させる
+                leases.release(lane, received.ack_id)
+                subscriber.modify_ack_deadline(request={
+                    'subscription': subscription_paths[lane],
+                    'ack_ids': [received.ack_id],
+                    'ack_deadline_seconds': 0
+                })
+                continue
+            leases.release(lane, received.ack_id)
+            subscriber.acknowledge(request={
+                'subscription': subscription_paths[lane],
+                'ack_ids': [received.ack_id]
+            })
+            scheduler.record_latency(lane, enqueued_at)
+    finally:
+        leases.stop()
+
+    metrics = scheduler.metrics()
+    for lane, stats in metrics.items():
+        logger.info(
+            f"Lane {lane}: {stats['count']} messages, "
+            f"avg latency {stats['avg_latency']:.1f}s, max latency {stats['max_latency']:.1f}s"
+        )
+    return metrics
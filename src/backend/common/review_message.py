@@ -0,0 +1,112 @@
+import os
+import json
+import zlib
+import base64
+
+# メッセージスキーマ設定
+SCHEMA_NAME = 'review'
+CURRENT_VERSION = 2
+# 移行期間中は REVIEW_MESSAGE_VERSION=1 で従来形式（GBPのレビューJSONそのまま）を公開できる
+PUBLISH_VERSION = int(os.environ.get('REVIEW_MESSAGE_VERSION', str(CURRENT_VERSION)))
+# このバイト数を超えるコメントは圧縮を試みる
+COMPRESS_THRESHOLD = int(os.environ.get('REVIEW_MESSAGE_COMPRESS_THRESHOLD', '512'))
+
+# GBP APIの星評価（列挙値）を数値に変換
+STAR_RATINGS = {'ONE': 1, 'TWO': 2, 'THREE': 3, 'FOUR': 4, 'FIVE': 5}
+
+def parse_rating(star_rating):
+    """GBPの星評価を1〜5の整数に変換（不明な場合はNone）"""
+    if isinstance(star_rating, dict):
+        star_rating = star_rating.get('rating')
+    if isinstance(star_rating, str):
+        return STAR_RATINGS.get(star_rating) or (int(star_rating) if star_rating.isdigit() else None)
+    return int(star_rating) if star_rating is not None else None
+
+def from_gbp_review(review):
+    """GBPのレビューJSONから生成処理に必要な項目だけを取り出す"""
+    parts = review['name'].split('/')
+    return {
+        'review_id': parts[-1],
+        'location_id': parts[3],
+        'rating': parse_rating(review.get('starRating')),
+        'author': review.get('reviewer', {}).get('displayName', 'Anonymous'),
+        'comment': review.get('comment', ''),
+        'create_time': review.get('createTime')
+    }
+
+def _encode_v1(review):
+    """従来形式：GBPのレビューJSONをそのまま送る"""
+    return json.dumps(review).encode('utf-8')
+
+def _encode_v2(review):
+    """コンパクト形式：必要な項目のみを短いキーで送り、長いコメントは圧縮する"""
+    message = from_gbp_review(review)
+    payload = {
+        'v': 2,
+        'rid': message['review_id'],
+        'lid': message['location_id'],
+        'r': message['rating'],
+        'a': message['author'],
+        't': message['create_time']
+    }
+    comment = message['comment'].encode('utf-8')
+    if len(comment) > COMPRESS_THRESHOLD:
+        compressed = base64.b64encode(zlib.compress(comment, 9)).decode('ascii')
+        if len(compressed) < len(comment):
+            payload['cz'] = compressed
+    if 'cz' not in payload:
+        payload['c'] = message['comment']
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _decode_v1(payload):
+    """従来形式のメッセージを復元"""
+    return from_gbp_review(payload)
+
+def _decode_v2(payload):
+    """コンパクト形式のメッセージを復元"""
+    if 'cz' in payload:
+        comment = zlib.decompress(base64.b64decode(payload['cz'])).decode('utf-8')
+    else:
+        comment = payload.get('c', '')
+    message = {
+        'review_id': payload['rid'],
+        'location_id': payload['lid'],
+        'rating': payload.get('r'),
+        'author': payload.get('a', 'Anonymous'),
+        'comment': comment,
+        'create_time': payload.get('t')
+    }
+    if not isinstance(message['review_id'], str) or not isinstance(message['location_id'], str):
+        raise ValueError('Invalid review message: review and location IDs must be strings')
+    if message['rating'] is not None and not isinstance(message['rating'], int):
+        raise ValueError('Invalid review message: rating must be an integer')
+    return message
+
+# スキーマレジストリ：バージョンごとのエンコーダ・デコーダ
+SCHEMA_REGISTRY = {
+    1: (_encode_v1, _decode_v1),
+    2: (_encode_v2, _decode_v2)
+}
+
+def encode_review(review, version=None):
+    """レビューをPub/Subメッセージ（データ, 属性）に変換"""
+    version = version or PUBLISH_VERSION
+    if version not in SCHEMA_REGISTRY:
+        raise ValueError(f"Unsupported review message version: {version}")
+    encode, _ = SCHEMA_REGISTRY[version]
+    attributes = {'schema': SCHEMA_NAME, 'schema_version': str(version)}
+    return encode(review), attributes
+
+def decode_review(data, attributes=None):
+    """Pub/Subメッセージを生成処理用のレビューに変換（従来形式・コンパクト形式の両方に対応）"""
+    attributes = attributes or {}
+    if attributes.get('schema', SCHEMA_NAME) != SCHEMA_NAME:
+        raise ValueError(f"Unexpected message schema: {attributes['schema']}")
+
+    payload = json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
+    # 属性がない従来の公開元のメッセージは本文から版を判定する
+    version = int(attributes.get('schema_version') or payload.get('v', 1))
+    if version not in SCHEMA_REGISTRY:
+        raise ValueError(f"Unsupported review message version: {version}")
+    _, decode = SCHEMA_REGISTRY[version]
+    return decode(payload)
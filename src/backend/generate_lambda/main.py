@@ -3,14 +3,19 @@ import json
 import logging
 from datetime import datetime
 import openai
+from google.cloud import pubsub_v1
 from firebase_admin import initialize_app, firestore
+from src.backend.common import review_message, priority, aggregates
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Firebase初期化
-initialize_app()
+# Firebase初期化（パイプラインランナーから複数の関数を読み込む場合は初期化済みのアプリを再利用）
+try:
+    initialize_app()
+except ValueError:
+    pass
 db = firestore.client()
 
 # OpenAI API設定
@@ -49,48 +54,101 @@ def generate_reply(review, tone):
         logger.error(f"Error generating reply: {str(e)}")
         raise
 
-def save_draft(review_id, reply, token_usage):
+def save_draft(review_id, reply, token_usage, location_id=None):
     """生成された返信をドラフトとして保存"""
+    created_at = datetime.utcnow()
     draft_ref = db.collection('drafts').document()
     draft_ref.set({
         'reviewId': review_id,
         'text': reply,
         'token_cost': token_usage,
-        'createdAt': datetime.utcnow()
+        'createdAt': created_at
     })
+    if location_id:
+        aggregates.record_draft(location_id, token_usage, created_at)
     return draft_ref.id
 
-def update_review_status(review_id, draft_id):
+def update_review_status(review_id, draft_id, location_id=None):
     """レビューのステータスを更新"""
     review_ref = db.collection('reviews').document(review_id)
+    review = review_ref.get()
+    previous_status = review.to_dict().get('status') if review.exists else None
     review_ref.update({
         'status': 'drafted',
         'draftId': draft_id
     })
+    # 再配信で同じレビューを再処理した場合は集計値を二重に減らさない
+    aggregates.record_status_change(location_id, previous_status, 'drafted')
+
+def publish_draft(review_id, draft_id, lane, queued_at=None):
+    """生成したドラフトを通知キューに公開（レーン有効時は優先レーン）"""
+    publisher = pubsub_v1.PublisherClient()
+    topic_path = publisher.topic_path(
+        os.environ['GOOGLE_CLOUD_PROJECT'],
+        priority.topic_name('draft-queue', lane)
+    )
+    
+    attributes = {'priority': lane}
+    if queued_at:
+        attributes['queued_at'] = queued_at
+    data = json.dumps({'review_id': review_id, 'draft_id': draft_id}).encode('utf-8')
+    # 公開の失敗（トピック未作成など）を握りつぶさず、レビューメッセージを再配信させる
+    publisher.publish(topic_path, data, **attributes).result()
+
+def process_review(review_id, location_id, review):
+    """レビュー1件の返信ドラフトを生成・保存し、ドラフトIDを返す"""
+    # 店舗設定を取得
+    settings = get_location_settings(location_id)
+    
+    # 返信を生成
+    reply, token_usage = generate_reply(review, settings['tone'])
+    
+    # ドラフトを保存
+    draft_id = save_draft(review_id, reply, token_usage, location_id)
+    
+    # レビューステータスを更新
+    update_review_status(review_id, draft_id, location_id)
+    
+    return draft_id
+
+def handle_review_message(data, attributes=None):
+    """Pub/Subのレビューメッセージを処理し、ドラフトを通知キューに渡す"""
+    attributes = attributes or {}
+    # 従来形式・コンパクト形式の両方に対応
+    review = review_message.decode_review(data, attributes)
+    review_id = review['review_id']
+    
+    draft_id = process_review(review_id, review['location_id'], review)
+    
+    lane = attributes.get('priority') or priority.classify_review(review)
+    publish_draft(review_id, draft_id, lane, attributes.get('queued_at'))
+    return review_id, draft_id
 
 def main(event, context):
     """Cloud Functionのメインエントリーポイント"""
     try:
         # Pub/Subメッセージからレビューデータを取得
-        pubsub_message = json.loads(event['data'].decode('utf-8'))
-        review_id = pubsub_message['name'].split('/')[-1]
-        location_id = pubsub_message['name'].split('/')[3]
-        
-        # 店舗設定を取得
-        settings = get_location_settings(location_id)
-        
-        # 返信を生成
-        reply, token_usage = generate_reply(pubsub_message, settings['tone'])
-        
-        # ドラフトを保存
-        draft_id = save_draft(review_id, reply, token_usage)
-        
-        # レビューステータスを更新
-        update_review_status(review_id, draft_id)
+        review_id, draft_id = handle_review_message(event['data'], event.get('attributes'))
         
         logger.info(f"Generated reply for review {review_id}")
         return {'status': 'success', 'draft_id': draft_id}
     
     except Exception as e:
         logger.error(f"Error in generate_lambda: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+def drain_main(event, context):
+    """優先レーンを重み付き公平に処理する定期実行用のエントリーポイント
+
+    PRIORITY_LANES_ENABLED=true の場合にmainの代わりにデプロイする（generate-<lane> のサブスクリプションが必要）。
+    """
+    try:
+        metrics = priority.drain_lanes(
+            'generate',
+            lambda message: handle_review_message(message.data, dict(message.attributes))
+        )
+        return {'status': 'success', 'lanes': metrics}
+    
+    except Exception as e:
+        logger.error(f"Error in generate_lambda drain: {str(e)}")
+        raise
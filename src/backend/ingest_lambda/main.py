@@ -1,18 +1,28 @@
 import os
 import json
+import time
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from google.cloud import pubsub_v1
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from firebase_admin import initialize_app, firestore
+from src.backend.common import review_message, priority, aggregates, minhash
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Firebase初期化
-initialize_app()
+# バックフィル設定
+BACKFILL_PAGE_SIZE = int(os.environ.get('BACKFILL_PAGE_SIZE', '50'))  # GBP APIの上限は50件
+# チェックポイントがこの秒数以上更新されていないバックフィルは中断したものとみなして再開する
+BACKFILL_STALE_SECONDS = int(os.environ.get('BACKFILL_STALE_SECONDS', '1800'))
+
+# Firebase初期化（パイプラインランナーから複数の関数を読み込む場合は初期化済みのアプリを再利用）
+try:
+    initialize_app()
+except ValueError:
+    pass
 db = firestore.client()
 
 def get_gbp_service():
@@ -26,67 +36,308 @@ def get_gbp_service():
 def get_new_reviews(location_id):
     """指定されたロケーションの新規レビューを取得"""
     service = get_gbp_service()
-    reviews = service.accounts().locations().reviews().list(
+    response = service.accounts().locations().reviews().list(
         name=f'accounts/{os.environ["GBP_ACCOUNT_ID"]}/locations/{location_id}'
     ).execute()
+    reviews = response.get('reviews', [])
 
     # 最終取得時刻以降のレビューのみをフィルタリング
     last_fetch = db.collection('last_fetch').document(location_id).get()
     if last_fetch.exists:
         last_fetch_time = last_fetch.to_dict()['timestamp']
-        reviews = [r for r in reviews.get('reviews', []) 
+        reviews = [r for r in reviews
                   if datetime.fromisoformat(r['createTime']) > last_fetch_time]
 
     return reviews
 
 def publish_to_pubsub(review):
-    """レビューをPub/Subに公開"""
+    """レビューをPub/Subに公開（レーン有効時は優先レーンに振り分ける）"""
+    lane = priority.classify_review(review_message.from_gbp_review(review))
     publisher = pubsub_v1.PublisherClient()
     topic_path = publisher.topic_path(
         os.environ['GOOGLE_CLOUD_PROJECT'],
-        'review-queue'
+        priority.topic_name('review-queue', lane)
     )
     
-    publisher.publish(topic_path, json.dumps(review).encode('utf-8'))
-    logger.info(f"Published review {review['name']} to Pub/Sub")
+    data, attributes = review_message.encode_review(review)
+    publisher.publish(
+        topic_path,
+        data,
+        priority=lane,
+        queued_at=str(time.time()),  # 店舗への通知までの待ち時間の計測用
+        **attributes
+    )
+    logger.info(f"Published review {review['name']} to Pub/Sub ({lane} lane)")
 
-def save_review_to_firestore(review):
-    """レビューをFirestoreに保存"""
-    review_ref = db.collection('reviews').document(review['name'].split('/')[-1])
-    review_ref.set({
+def build_review_doc(review, status='new'):
+    """GBPのレビューJSONからFirestoreに保存するドキュメントを作成"""
+    return {
         'locationId': review['name'].split('/')[3],
         'author': review.get('reviewer', {}).get('displayName', 'Anonymous'),
-        'rating': review.get('starRating', {}).get('rating'),
+        'rating': review_message.parse_rating(review.get('starRating')),
         'comment': review.get('comment', ''),
         'time': review['createTime'],
-        'status': 'new'
+        'status': status
+    }
+
+def get_tenant_id(location_id):
+    """ロケーションが属するテナントIDを取得（未設定の場合はロケーションID）"""
+    location = db.collection('locations').document(location_id).get()
+    if not location.exists:
+        return location_id
+    return location.to_dict().get('tenantId', location_id)
+
+def detect_duplicate(tenant_id, review):
+    """同じテナント内のコピペ・スパムなどの近似重複レビューを検出"""
+    return minhash.find_duplicate(
+        tenant_id,
+        review['name'].split('/')[-1],
+        review.get('comment', '')
+    )
+
+def apply_duplicate(review_doc, duplicate):
+    """近似重複のレビューに代表レビューの情報を設定"""
+    # 代表レビューのドラフトがあれば共有し、なければ生成・通知の対象外として保存
+    canonical = db.collection('reviews').document(duplicate['clusterId']).get()
+    draft_id = canonical.to_dict().get('draftId') if canonical.exists else None
+    review_doc.update({
+        'status': 'drafted' if draft_id else 'duplicate',
+        'duplicateOf': duplicate['duplicateOf'],
+        'clusterId': duplicate['clusterId']
     })
+    if draft_id:
+        review_doc['draftId'] = draft_id
+    return review_doc
+
+def save_review_to_firestore(review, duplicate=None):
+    """レビューをFirestoreに保存"""
+    review_ref = db.collection('reviews').document(review['name'].split('/')[-1])
+    review_doc = build_review_doc(review)
+    if duplicate:
+        apply_duplicate(review_doc, duplicate)
+    review_ref.set(review_doc)
+    aggregates.record_reviews(review_doc['locationId'], [review_doc])
     logger.info(f"Saved review {review['name']} to Firestore")
 
-def update_last_fetch(location_id):
+def update_last_fetch(location_id, timestamp=None):
     """最終取得時刻を更新"""
     db.collection('last_fetch').document(location_id).set({
-        'timestamp': datetime.utcnow()
+        'timestamp': timestamp or datetime.utcnow()
     })
 
+def iter_review_pages(location_id, page_token=None, page_size=BACKFILL_PAGE_SIZE):
+    """ロケーションの全レビューをページ単位で取得し、(レビュー, 次ページトークン)を順に返す"""
+    service = get_gbp_service()
+    while True:
+        params = {
+            'name': f'accounts/{os.environ["GBP_ACCOUNT_ID"]}/locations/{location_id}',
+            'pageSize': page_size
+        }
+        if page_token:
+            params['pageToken'] = page_token
+        response = service.accounts().locations().reviews().list(**params).execute()
+        page_token = response.get('nextPageToken')
+        yield response.get('reviews', []), page_token
+        if not page_token:
+            return
+
+def get_backfill_checkpoint(location_id):
+    """バックフィルのチェックポイントを取得"""
+    checkpoint = db.collection('backfill_checkpoints').document(location_id).get()
+    return checkpoint.to_dict() if checkpoint.exists else None
+
+def save_backfill_checkpoint(location_id, checkpoint):
+    """バックフィルのチェックポイントを保存"""
+    checkpoint['updatedAt'] = datetime.utcnow()
+    db.collection('backfill_checkpoints').document(location_id).set(checkpoint)
+
+def to_naive_utc(value):
+    """タイムゾーン付き日時をUTCのnaiveな日時に揃える"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def should_generate_draft(review, recent_since=None, unanswered_only=True):
+    """バックフィル時に返信ドラフトを生成する対象かを判定"""
+    if unanswered_only and review.get('reviewReply'):
+        return False
+    if recent_since is not None:
+        create_time = datetime.fromisoformat(review['createTime'].replace('Z', '+00:00'))
+        return to_naive_utc(create_time) >= recent_since
+    return True
+
+def filter_unsaved_reviews(reviews):
+    """Firestoreに未保存のレビューだけを返す（1ページ分をまとめて読み取る）"""
+    if not reviews:
+        return []
+    review_refs = [db.collection('reviews').document(r['name'].split('/')[-1]) for r in reviews]
+    saved_ids = {snapshot.id for snapshot in db.get_all(review_refs) if snapshot.exists}
+    return [r for r in reviews if r['name'].split('/')[-1] not in saved_ids]
+
+def save_reviews_batch(reviews, draft_targets, duplicates=None):
+    """1ページ分の未保存レビューをバッチ書き込みでFirestoreに保存"""
+    if not reviews:
+        return
+    duplicates = duplicates or {}
+    batch = db.batch()
+    review_docs = []
+    for review in reviews:
+        review_ref = db.collection('reviews').document(review['name'].split('/')[-1])
+        status = 'new' if review['name'] in draft_targets else 'backfilled'
+        review_docs.append(build_review_doc(review, status=status))
+        if review['name'] in duplicates:
+            apply_duplicate(review_docs[-1], duplicates[review['name']])
+        # 既存のレビューを上書きしないようcreateを使う（競合時はバッチ全体が失敗し、再開時に除外される）
+        batch.create(review_ref, review_docs[-1])
+    batch.commit()
+
+    # 集計値もページ単位で1回だけ加算する
+    aggregates.record_reviews(review_docs[0]['locationId'], review_docs)
+
+def backfill_location(location_id, recent_days=None, unanswered_only=True, publish=None):
+    """ロケーションの全レビュー履歴をページ単位で取り込む（中断時はチェックポイントから再開）
+
+    publishはドラフト生成対象のレビューを渡す先（省略時はPub/Sub、パイプラインランナーではプロセス内のキュー）。
+    """
+    publish = publish or publish_to_pubsub
+    checkpoint = get_backfill_checkpoint(location_id)
+    if checkpoint and checkpoint.get('done'):
+        logger.info(f"Backfill already completed for location {location_id}")
+        return checkpoint
+
+    if not checkpoint:
+        checkpoint = {
+            'pageToken': None,
+            'processed': 0,
+            'drafted': 0,
+            'pendingPublish': [],
+            'startedAt': datetime.utcnow(),
+            'done': False
+        }
+        # 他の実行が同じロケーションを並行して取り込まないよう開始時点で保存する
+        save_backfill_checkpoint(location_id, checkpoint)
+
+    tenant_id = get_tenant_id(location_id)
+    recent_since = None
+    if recent_days is not None:
+        # 再開時はFirestoreからタイムゾーン付きで読み出される
+        recent_since = to_naive_utc(checkpoint['startedAt']) - timedelta(days=recent_days)
+
+    for page, next_page_token in iter_review_pages(location_id, checkpoint['pageToken']):
+        # 通常の取り込みで保存済みのレビューは状態・ドラフトを保持したまま対象外にする
+        reviews = filter_unsaved_reviews(page)
+        # 近似重複は通常の取り込みと同様に返信生成・LINE通知を行わない
+        duplicates = {}
+        for review in reviews:
+            duplicate = detect_duplicate(tenant_id, review)
+            if duplicate:
+                duplicates[review['name']] = duplicate
+        draft_targets = {
+            review['name'] for review in reviews
+            if review['name'] not in duplicates
+            and should_generate_draft(review, recent_since, unanswered_only)
+        }
+        # 前回の実行が保存後・公開前に中断したページでは、保存済みの公開待ちレビューも公開する
+        draft_targets |= {
+            review['name'] for review in page
+            if review['name'] in checkpoint.get('pendingPublish', [])
+        }
+
+        # 保存前に公開待ちのレビューを記録し、再開時に公開漏れが起きないようにする
+        checkpoint['pendingPublish'] = sorted(draft_targets)
+        save_backfill_checkpoint(location_id, checkpoint)
+        save_reviews_batch(reviews, draft_targets, duplicates)
+        for review in page:
+            if review['name'] in draft_targets:
+                publish(review)
+
+        # ページ処理後にチェックポイントを進める（再開時はこのページの次から）
+        checkpoint['pageToken'] = next_page_token
+        checkpoint['pendingPublish'] = []
+        checkpoint['processed'] += len(page)
+        checkpoint['drafted'] += len(draft_targets)
+        checkpoint['done'] = next_page_token is None
+        save_backfill_checkpoint(location_id, checkpoint)
+
+    # バックフィル開始以降のレビューは通常の取り込みで拾う
+    update_last_fetch(location_id, checkpoint['startedAt'])
+    aggregates.rollup_location_stats(location_id)
+    logger.info(f"Backfilled {checkpoint['processed']} reviews for location {location_id}")
+    return checkpoint
+
+def get_backfill_status(location_id):
+    """バックフィルの状態を判定
+
+    'running': 他の実行がバックフィル中、'required': 未取り込み（最終取得時刻なし）または
+    中断したバックフィルの再開が必要、None: 通常の取り込み対象。
+    """
+    checkpoint = get_backfill_checkpoint(location_id)
+    if checkpoint and not checkpoint.get('done'):
+        updated_at = checkpoint.get('updatedAt')
+        if updated_at and datetime.utcnow() - to_naive_utc(updated_at) < timedelta(seconds=BACKFILL_STALE_SECONDS):
+            return 'running'
+        return 'required'
+    if not checkpoint and not db.collection('last_fetch').document(location_id).get().exists:
+        return 'required'
+    return None
+
 def main(event, context):
     """Cloud Functionのメインエントリーポイント"""
     try:
         # 設定されたロケーションIDを取得
         locations = db.collection('locations').stream()
+        processed = 0
         
         for location in locations:
             location_id = location.id
-            reviews = get_new_reviews(location_id)
+            # 新しいロケーションは履歴全体をバックフィルで取り込み、同じレビューの二重処理を防ぐ
+            backfill_status = get_backfill_status(location_id)
+            if backfill_status == 'running':
+                logger.info(f"Skipping location {location_id}: backfill running")
+                continue
+            if backfill_status == 'required':
+                processed += backfill_location(location_id)['processed']
+                continue
+            tenant_id = location.to_dict().get('tenantId', location_id)
+            # バックフィルで保存済みのレビューを上書き・再公開しない
+            reviews = filter_unsaved_reviews(get_new_reviews(location_id))
+            processed += len(reviews)
             
             for review in reviews:
-                save_review_to_firestore(review)
-                publish_to_pubsub(review)
+                duplicate = detect_duplicate(tenant_id, review)
+                save_review_to_firestore(review, duplicate)
+                # 近似重複は返信生成・LINE通知を行わない
+                if not duplicate:
+                    publish_to_pubsub(review)
             
             update_last_fetch(location_id)
             
-        return {'status': 'success', 'message': f'Processed {len(reviews)} reviews'}
+            # ダッシュボード用の集計ドキュメントを更新（前回以降に集計値が変わった場合のみ）
+            aggregates.rollup_location_stats(location_id)
+            
+        return {'status': 'success', 'message': f'Processed {processed} reviews'}
     
     except Exception as e:
         logger.error(f"Error in ingest_lambda: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+def backfill_main(event, context):
+    """バックフィル用Cloud Functionのエントリーポイント"""
+    try:
+        # Pub/Subメッセージからバックフィル対象を取得
+        request = json.loads(event['data'].decode('utf-8'))
+        checkpoint = backfill_location(
+            request['location_id'],
+            recent_days=request.get('recent_days'),
+            unanswered_only=request.get('unanswered_only', True)
+        )
+        
+        return {
+            'status': 'success',
+            'message': f"Backfilled {checkpoint['processed']} reviews",
+            'drafted': checkpoint['drafted']
+        }
+    
+    except Exception as e:
+        logger.error(f"Error in ingest_lambda backfill: {str(e)}")
+        raise
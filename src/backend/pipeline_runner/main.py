@@ -0,0 +1,210 @@
+import os
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from src.backend.ingest_lambda import main as ingest
+from src.backend.generate_lambda import main as generate
+from src.backend.push_lambda import main as push
+from src.backend.common import review_message, aggregates
+
+# ログ設定
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 各ステージの既定の並列数とキューサイズ
+DEFAULT_INGEST_CONCURRENCY = int(os.environ.get('PIPELINE_INGEST_CONCURRENCY', '2'))
+DEFAULT_GENERATE_CONCURRENCY = int(os.environ.get('PIPELINE_GENERATE_CONCURRENCY', '4'))
+DEFAULT_PUSH_CONCURRENCY = int(os.environ.get('PIPELINE_PUSH_CONCURRENCY', '2'))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '100'))
+
+# ワーカー終了を通知する番兵
+_DONE = object()
+
+def list_location_ids():
+    """処理対象のロケーションIDを取得"""
+    return [location.id for location in ingest.db.collection('locations').stream()]
+
+async def _enqueue(review_queue, review, stats):
+    """レビューを生成ステージのキューに渡す"""
+    # キューが満杯の間はここで待機し、下流の遅延を上流に伝える
+    await review_queue.put(review_message.from_gbp_review(review))
+    stats['ingested'] += 1
+
+async def backfill(location_id, review_queue, stats, recent_days=None, unanswered_only=True):
+    """ロケーションの履歴をバックフィルし、ドラフト生成対象をPub/Subではなくキューに渡す"""
+    loop = asyncio.get_running_loop()
+
+    def publish(review):
+        # バックフィルはワーカースレッドで動くため、キューの空きを待ってから次のレビューに進む
+        asyncio.run_coroutine_threadsafe(_enqueue(review_queue, review, stats), loop).result()
+
+    await asyncio.to_thread(
+        ingest.backfill_location, location_id,
+        recent_days=recent_days, unanswered_only=unanswered_only, publish=publish
+    )
+
+async def ingest_worker(location_queue, review_queue, stats, backfill_options=None):
+    """ロケーションごとに新規レビューを取得・保存して次のステージへ渡す
+
+    backfill_optionsを指定した場合は新規レビューの代わりに履歴全体をバックフィルする。
+    """
+    while True:
+        location_id = await location_queue.get()
+        if location_id is _DONE:
+            return
+        try:
+            if backfill_options is not None:
+                await backfill(location_id, review_queue, stats, **backfill_options)
+                continue
+            # 新しいロケーションは履歴全体をバックフィルで取り込み、同じレビューの二重処理を防ぐ
+            backfill_status = await asyncio.to_thread(ingest.get_backfill_status, location_id)
+            if backfill_status == 'running':
+                logger.info(f"Skipping location {location_id}: backfill running")
+                continue
+            if backfill_status == 'required':
+                await backfill(location_id, review_queue, stats)
+                continue
+            tenant_id = await asyncio.to_thread(ingest.get_tenant_id, location_id)
+            reviews = await asyncio.to_thread(ingest.get_new_reviews, location_id)
+            # バックフィルで保存済みのレビューを上書き・再公開しない
+            reviews = await asyncio.to_thread(ingest.filter_unsaved_reviews, reviews)
+            for review in reviews:
+                duplicate = await asyncio.to_thread(ingest.detect_duplicate, tenant_id, review)
+                await asyncio.to_thread(ingest.save_review_to_firestore, review, duplicate)
+                # 近似重複は返信生成・LINE通知を行わない
+                if duplicate:
+                    stats['duplicates'] += 1
+                    continue
+                await _enqueue(review_queue, review, stats)
+            await asyncio.to_thread(ingest.update_last_fetch, location_id)
+        except Exception as e:
+            stats['failed'] += 1
+            logger.error(f"Error ingesting location {location_id}: {str(e)}")
+
+async def generate_worker(review_queue, draft_queue, stats):
+    """レビューの返信ドラフトを生成して次のステージへ渡す"""
+    while True:
+        review = await review_queue.get()
+        if review is _DONE:
+            return
+        try:
+            draft_id = await asyncio.to_thread(
+                generate.process_review, review['review_id'], review['location_id'], review
+            )
+            await draft_queue.put({'review_id': review['review_id'], 'draft_id': draft_id})
+            stats['drafted'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            logger.error(f"Error generating reply for review {review['review_id']}: {str(e)}")
+
+async def push_worker(draft_queue, stats):
+    """ドラフトをLINEで店舗に通知"""
+    while True:
+        item = await draft_queue.get()
+        if item is _DONE:
+            return
+        try:
+            if await asyncio.to_thread(
+                push.send_review_notification, item['review_id'], item['draft_id']
+            ):
+                stats['pushed'] += 1
+        except Exception as e:
+            stats['failed'] += 1
+            logger.error(f"Error pushing review {item['review_id']}: {str(e)}")
+
+async def _run_stage(workers, next_queue=None, next_concurrency=0):
+    """ステージの全ワーカー終了後、次のステージのワーカー数だけ番兵を流す"""
+    await asyncio.gather(*workers)
+    for _ in range(next_concurrency):
+        await next_queue.put(_DONE)
+
+async def run_pipeline(location_ids=None,
+                       ingest_concurrency=DEFAULT_INGEST_CONCURRENCY,
+                       generate_concurrency=DEFAULT_GENERATE_CONCURRENCY,
+                       push_concurrency=DEFAULT_PUSH_CONCURRENCY,
+                       queue_size=DEFAULT_QUEUE_SIZE,
+                       backfill_options=None):
+    """取得・生成・通知の各ステージを有界キューでつないで1プロセスで実行
+
+    backfill_optionsにはbackfill_locationのrecent_days・unanswered_onlyを指定する。
+    """
+    # ブロッキングなSDK呼び出しがステージの並列数を使い切れるようにスレッド数を確保
+    # （既定のエグゼキュータが作られる前に、最初のto_threadより先に設定する）
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=ingest_concurrency + generate_concurrency + push_concurrency
+    ))
+
+    if location_ids is None:
+        location_ids = await asyncio.to_thread(list_location_ids)
+
+    location_queue = asyncio.Queue()
+    for location_id in location_ids:
+        location_queue.put_nowait(location_id)
+    for _ in range(ingest_concurrency):
+        location_queue.put_nowait(_DONE)
+
+    review_queue = asyncio.Queue(maxsize=queue_size)
+    draft_queue = asyncio.Queue(maxsize=queue_size)
+    stats = {'ingested': 0, 'duplicates': 0, 'drafted': 0, 'pushed': 0, 'failed': 0}
+
+    await asyncio.gather(
+        _run_stage(
+            [ingest_worker(location_queue, review_queue, stats, backfill_options)
+             for _ in range(ingest_concurrency)],
+            review_queue, generate_concurrency
+        ),
+        _run_stage(
+            [generate_worker(review_queue, draft_queue, stats)
+             for _ in range(generate_concurrency)],
+            draft_queue, push_concurrency
+        ),
+        _run_stage(
+            [push_worker(draft_queue, stats) for _ in range(push_concurrency)]
+        )
+    )
+
+    # 生成・保存で変わった集計値をダッシュボード用の集計ドキュメントに反映
+    for location_id in location_ids:
+        await asyncio.to_thread(aggregates.rollup_location_stats, location_id)
+
+    logger.info(f"Pipeline finished: {stats}")
+    return {'status': 'success', **stats}
+
+def main():
+    """コマンドラインのエントリーポイント"""
+    parser = argparse.ArgumentParser(description='レビュー処理パイプラインを1プロセスで実行')
+    parser.add_argument('--location', action='append', dest='location_ids',
+                        help='処理するロケーションID（複数指定可、省略時は全ロケーション）')
+    parser.add_argument('--ingest-concurrency', type=int, default=DEFAULT_INGEST_CONCURRENCY)
+    parser.add_argument('--generate-concurrency', type=int, default=DEFAULT_GENERATE_CONCURRENCY)
+    parser.add_argument('--push-concurrency', type=int, default=DEFAULT_PUSH_CONCURRENCY)
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--backfill', action='store_true',
+                        help='新規レビューの代わりにレビュー履歴全体を取り込む')
+    parser.add_argument('--recent-days', type=int,
+                        help='バックフィル時に返信を生成する直近の日数（省略時は全期間）')
+    parser.add_argument('--include-answered', action='store_true',
+                        help='バックフィル時に返信済みのレビューも返信を生成する')
+    args = parser.parse_args()
+
+    backfill_options = None
+    if args.backfill:
+        backfill_options = {
+            'recent_days': args.recent_days,
+            'unanswered_only': not args.include_answered
+        }
+
+    return asyncio.run(run_pipeline(
+        location_ids=args.location_ids,
+        ingest_concurrency=args.ingest_concurrency,
+        generate_concurrency=args.generate_concurrency,
+        push_concurrency=args.push_concurrency,
+        queue_size=args.queue_size,
+        backfill_options=backfill_options
+    ))
+
+if __name__ == '__main__':
+    main()
@@ -5,13 +5,17 @@ from datetime import datetime
 from linebot import LineBotApi, WebhookHandler
 from linebot.models import FlexSendMessage, TextSendMessage
 from firebase_admin import initialize_app, firestore
+from src.backend.common import priority
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Firebase初期化
-initialize_app()
+# Firebase初期化（パイプラインランナーから複数の関数を読み込む場合は初期化済みのアプリを再利用）
+try:
+    initialize_app()
+except ValueError:
+    pass
 db = firestore.client()
 
 # LINE Bot API設定
@@ -80,6 +84,32 @@ def create_flex_message(review, draft):
         }
     }
 
+def send_review_notification(review_id, draft_id):
+    """レビューとドラフトをLINEで店舗に通知し、送信できたかを返す"""
+    # レビューとドラフトを取得
+    review_ref = db.collection('reviews').document(review_id)
+    draft_ref = db.collection('drafts').document(draft_id)
+    
+    review = review_ref.get().to_dict()
+    review['id'] = review_id  # ポストバックデータに使用
+    draft = draft_ref.get().to_dict()
+    
+    # 店舗のLINEユーザーIDを取得
+    line_user_id = get_location_line_id(review['locationId'])
+    if not line_user_id:
+        logger.error(f"LINE user ID not found for location {review['locationId']}")
+        return False
+    
+    # Flex Messageを作成して送信
+    flex_message = create_flex_message(review, draft)
+    line_bot_api.push_message(
+        line_user_id,
+        FlexSendMessage(alt_text=flex_message['altText'], contents=flex_message['contents'])
+    )
+    
+    logger.info(f"Sent LINE message for review {review_id}")
+    return True
+
 def main(event, context):
     """Cloud Functionのメインエントリーポイント"""
     try:
@@ -88,29 +118,29 @@ def main(event, context):
         review_id = pubsub_message['review_id']
         draft_id = pubsub_message['draft_id']
         
-        # レビューとドラフトを取得
-        review_ref = db.collection('reviews').document(review_id)
-        draft_ref = db.collection('drafts').document(draft_id)
-        
-        review = review_ref.get().to_dict()
-        draft = draft_ref.get().to_dict()
-        
-        # 店舗のLINEユーザーIDを取得
-        line_user_id = get_location_line_id(review['locationId'])
-        if not line_user_id:
-            logger.error(f"LINE user ID not found for location {review['locationId']}")
+        if not send_review_notification(review_id, draft_id):
             return
         
-        # Flex Messageを作成して送信
-        flex_message = create_flex_message(review, draft)
-        line_bot_api.push_message(
-            line_user_id,
-            FlexSendMessage(alt_text=flex_message['altText'], contents=flex_message['contents'])
-        )
-        
-        logger.info(f"Sent LINE message for review {review_id}")
         return {'status': 'success'}
     
     except Exception as e:
         logger.error(f"Error in push_lambda: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
+
+def handle_draft_message(message):
+    """Pub/Subのドラフトメッセージを処理"""
+    payload = json.loads(message.data.decode('utf-8'))
+    send_review_notification(payload['review_id'], payload['draft_id'])
+
+def drain_main(event, context):
+    """優先レーンを重み付き公平に処理する定期実行用のエントリーポイント
+
+    PRIORITY_LANES_ENABLED=true の場合にmainの代わりにデプロイする（push-<lane> のサブスクリプションが必要）。
+    """
+    try:
+        metrics = priority.drain_lanes('push', handle_draft_message)
+        return {'status': 'success', 'lanes': metrics}
+    
+    except Exception as e:
+        logger.error(f"Error in push_lambda drain: {str(e)}")
+        raise
@@ -0,0 +1,73 @@
+"""MinHash LSHインデックスの検索性能ベンチマーク
+
+リポジトリのルートで実行:
+    python -m tests.performance.minhash_benchmark --signatures 1000000
+"""
+import os
+import time
+import random
+import argparse
+import resource
+from array import array
+from src.backend.common.minhash import NUM_PERM, MinHashIndex
+
+def build_index(count):
+    """ランダムな署名を一括読み込みしたインデックスを作成"""
+    signatures = array('I')
+    signatures.frombytes(os.urandom(count * NUM_PERM * signatures.itemsize))
+    review_ids = [f'r{row}' for row in range(count)]
+
+    started = time.perf_counter()
+    index = MinHashIndex.from_signatures(review_ids, signatures)
+    return index, time.perf_counter() - started
+
+def make_queries(index, count, duplicate_ratio, rng):
+    """既存署名の一部を変えた近似重複と、ランダムな署名を混ぜた検索クエリを作成"""
+    queries = []
+    for _ in range(count):
+        if rng.random() < duplicate_ratio:
+            row = rng.randrange(len(index))
+            signature = index.signatures[row * NUM_PERM:(row + 1) * NUM_PERM]
+            for position in rng.sample(range(NUM_PERM), 3):
+                signature[position] = rng.getrandbits(32)
+        else:
+            signature = array('I', (rng.getrandbits(32) for _ in range(NUM_PERM)))
+        queries.append(signature)
+    return queries
+
+def main():
+    parser = argparse.ArgumentParser(description='MinHash LSHインデックスの検索性能を計測')
+    parser.add_argument('--signatures', type=int, default=1000000, help='インデックスに格納する署名数')
+    parser.add_argument('--queries', type=int, default=20000, help='検索回数')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1, help='近似重複クエリの割合')
+    parser.add_argument('--inserts', type=int, default=20000, help='逐次追加の回数')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index, build_seconds = build_index(args.signatures)
+    signature_mb = len(index.signatures) * index.signatures.itemsize / 1024 / 1024
+    bucket_mb = sum(
+        len(table.keys) * table.keys.itemsize + len(table.rows) * table.rows.itemsize
+        for table in index.tables + [index.id_table]
+    ) / 1024 / 1024
+    # 一括読み込み時の並べ替えを含むプロセス全体の最大メモリ（LinuxではKB単位）
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Loaded {len(index):,} signatures in {build_seconds:.1f}s "
+          f"(signatures {signature_mb:.0f} MB, buckets {bucket_mb:.0f} MB, peak RSS {peak_mb:.0f} MB)")
+
+    queries = make_queries(index, args.queries, args.duplicate_ratio, rng)
+    started = time.perf_counter()
+    matches = sum(1 for signature in queries if index.query(signature))
+    elapsed = time.perf_counter() - started
+    print(f"Lookups: {args.queries / elapsed:,.0f}/s "
+          f"({elapsed / args.queries * 1e6:.1f} us/lookup, {matches:,} matches)")
+
+    inserts = make_queries(index, args.inserts, 0, rng)
+    started = time.perf_counter()
+    for i, signature in enumerate(inserts):
+        index.add(f'n{i}', signature)
+    elapsed = time.perf_counter() - started
+    print(f"Inserts: {args.inserts / elapsed:,.0f}/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from datetime import datetime
+from src.backend.common.aggregates import (
+    record_reviews,
+    record_status_change,
+    record_draft,
+    get_location_stats,
+    rollup_location_stats
+)
+from src.backend.common import aggregates
+
+@pytest.fixture
+def mock_firestore():
+    with patch('src.backend.common.aggregates.firestore') as mock_firestore:
+        mock_firestore.Increment.side_effect = lambda value: ('increment', value)
+        yield mock_firestore
+
+def shard_ref(mock_firestore):
+    return mock_firestore.client().collection().document().collection().document()
+
+def test_record_reviews(mock_firestore):
+    """レビュー件数・評価分布の加算テスト"""
+    record_reviews('456', [
+        {'rating': 5, 'status': 'new'},
+        {'rating': 5, 'status': 'backfilled'},
+        {'rating': None, 'status': 'backfilled'}
+    ])
+
+    shard_ref(mock_firestore).set.assert_called_once_with({
+        'reviews': ('increment', 3),
+        'ratings': {'5': ('increment', 2), 'unknown': ('increment', 1)},
+        'statuses': {'new': ('increment', 1), 'backfilled': ('increment', 2)},
+        'updatedAt': mock_firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+def test_record_status_change(mock_firestore):
+    """ステータス変更の反映テスト"""
+    record_status_change('456', 'drafted', 'posted')
+    shard_ref(mock_firestore).set.assert_called_once_with({
+        'statuses': {'posted': ('increment', 1), 'drafted': ('increment', -1)},
+        'updatedAt': mock_firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+    record_status_change('456', 'posted', 'posted')
+    record_status_change(None, 'drafted', 'posted')
+    assert shard_ref(mock_firestore).set.call_count == 1
+
+def test_record_draft(mock_firestore):
+    """月別トークン使用量の加算テスト"""
+    record_draft('456', 120, datetime(2026, 10, 19))
+    shard_ref(mock_firestore).set.assert_called_once_with({
+        'drafts': {'2026-10': ('increment', 1)},
+        'tokens': {'2026-10': ('increment', 120)},
+        'updatedAt': mock_firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+def test_record_draft_without_tokens(mock_firestore):
+    """トークン0のドラフトで月別トークン集計を空のマップで上書きしないテスト"""
+    record_draft('456', 0, datetime(2026, 10, 19))
+    shard_ref(mock_firestore).set.assert_called_once_with({
+        'drafts': {'2026-10': ('increment', 1)},
+        'updatedAt': mock_firestore.SERVER_TIMESTAMP
+    }, merge=True)
+
+    record_status_change('456', None, None)
+    record_reviews('456', [])
+    assert shard_ref(mock_firestore).set.call_count == 1
+
+def test_get_and_rollup_location_stats(mock_firestore):
+    """シャードの合計と集計ドキュメントへの書き込みテスト"""
+    shards = [
+        MagicMock(to_dict=MagicMock(return_value={
+            'reviews': 2, 'ratings': {'5': 2}, 'tokens': {'2026-10': 100}
+        })),
+        MagicMock(to_dict=MagicMock(return_value={
+            'reviews': 1, 'ratings': {'1': 1}, 'statuses': {'new': 1}, 'tokens': {'2026-10': 50}
+        }))
+    ]
+    mock_firestore.client().collection().document().collection().stream.return_value = shards
+
+    stats = get_location_stats('456')
+    assert stats['reviews'] == 3
+    assert stats['ratings'] == {'5': 2, '1': 1}
+    assert stats['statuses'] == {'new': 1}
+    assert stats['tokens'] == {'2026-10': 150}
+
+    rollup_location_stats('456', only_if_changed=False)
+    written = mock_firestore.client().collection().document().set.call_args.args[0]
+    assert written['reviews'] == 3
+    assert 'updatedAt' in written
+
+def test_rollup_skipped_when_shards_unchanged(mock_firestore):
+    """前回の集計以降にシャードの更新がなければ集計ドキュメントを書き込まないテスト"""
+    stats_ref = mock_firestore.client().collection().document()
+    summary = MagicMock(exists=True)
+    summary.to_dict.return_value = {'shardsUpdatedAt': datetime(2026, 10, 19)}
+    stats_ref.get.return_value = summary
+    stats_ref.collection().where().limit().stream.return_value = []
+
+    assert rollup_location_stats('456') is None
+    stats_ref.set.assert_not_called()
+
+    stats_ref.collection().where().limit().stream.return_value = [MagicMock()]
+    assert aggregates.has_unrolled_changes('456')
@@ -6,6 +6,7 @@ from src.backend.generate_lambda.main import (
     generate_reply,
     save_draft,
     update_review_status,
+    publish_draft,
     main
 )
 
@@ -58,6 +59,33 @@ def test_update_review_status(mock_firestore):
     update_review_status('789', 'abc123')
     mock_firestore.client().collection().document().update.assert_called_once()
 
+def test_update_review_status_on_redelivery():
+    """再配信で生成済みのレビューを再処理してもステータス別件数を変えないテスト"""
+    with patch('src.backend.generate_lambda.main.db') as mock_db, \
+         patch('src.backend.generate_lambda.main.aggregates') as mock_aggregates:
+        review = MagicMock(exists=True)
+        review.to_dict.return_value = {'status': 'new'}
+        mock_db.collection().document().get.return_value = review
+
+        update_review_status('789', 'abc123', '456')
+        mock_aggregates.record_status_change.assert_called_with('456', 'new', 'drafted')
+
+        review.to_dict.return_value = {'status': 'drafted', 'draftId': 'abc123'}
+        update_review_status('789', 'def456', '456')
+        mock_aggregates.record_status_change.assert_called_with('456', 'drafted', 'drafted')
+
+def test_publish_draft_surfaces_publish_errors():
+    """トピック未作成などの公開エラーを握りつぶさないテスト"""
+    with patch('src.backend.generate_lambda.main.pubsub_v1.PublisherClient') as mock_publisher, \
+         patch.dict('os.environ', {'GOOGLE_CLOUD_PROJECT': 'test-project'}):
+        mock_publisher.return_value.topic_path.side_effect = lambda project, topic: topic
+        mock_publisher.return_value.publish.return_value.result.side_effect = RuntimeError('NotFound')
+
+        with pytest.raises(RuntimeError):
+            publish_draft('789', 'abc123', 'urgent')
+
+    assert mock_publisher.return_value.publish.call_args.args[0] == 'draft-queue'
+
 def test_main(mock_firestore, mock_openai):
     """メイン関数のテスト"""
     # モックデータの設定
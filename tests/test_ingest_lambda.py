@@ -6,7 +6,11 @@ from src.backend.ingest_lambda.main import (
     get_new_reviews,
     publish_to_pubsub,
     save_review_to_firestore,
+    build_review_doc,
     update_last_fetch,
+    should_generate_draft,
+    backfill_location,
+    get_backfill_status,
     main
 )
 
@@ -113,4 +117,233 @@ def test_main(mock_gbp_service, mock_firestore, mock_pubsub):
     # テスト実行
     result = main({}, {})
     assert result['status'] == 'success'
-    assert 'message' in result 
\ No newline at end of file
+    assert 'message' in result
+
+def test_should_generate_draft():
+    """バックフィル時のドラフト生成対象判定テスト"""
+    recent = {'createTime': (datetime.utcnow() - timedelta(days=1)).isoformat() + 'Z'}
+    old = {'createTime': (datetime.utcnow() - timedelta(days=400)).isoformat() + 'Z'}
+    answered = {**recent, 'reviewReply': {'comment': 'ありがとうございます'}}
+    recent_since = datetime.utcnow() - timedelta(days=30)
+
+    assert should_generate_draft(recent, recent_since)
+    assert not should_generate_draft(old, recent_since)
+    assert not should_generate_draft(answered, recent_since)
+    assert should_generate_draft(answered, recent_since, unanswered_only=False)
+
+def test_backfill_location_resumes_from_checkpoint(mock_gbp_service, mock_pubsub):
+    """チェックポイントのページトークンから再開するバックフィルのテスト"""
+    def make_review(review_id, days_ago):
+        return {
+            'name': f'accounts/123/locations/456/reviews/{review_id}',
+            'createTime': (datetime.utcnow() - timedelta(days=days_ago)).isoformat(),
+            'reviewer': {'displayName': 'Test User'},
+            'starRating': {'rating': 5},
+            'comment': 'Great service!'
+        }
+
+    mock_list = mock_gbp_service.accounts().locations().reviews().list
+    mock_list.return_value.execute.side_effect = [
+        {'reviews': [make_review('1', 1), make_review('2', 500)], 'nextPageToken': 'page-3'},
+        {'reviews': [make_review('3', 900)]}
+    ]
+
+    with patch('src.backend.ingest_lambda.main.db') as mock_db:
+        mock_checkpoint = MagicMock()
+        mock_checkpoint.exists = True
+        mock_checkpoint.to_dict.return_value = {
+            'pageToken': 'page-2',
+            'processed': 50,
+            'drafted': 3,
+            'startedAt': datetime.utcnow(),
+            'done': False
+        }
+        mock_db.collection().document().get.return_value = mock_checkpoint
+
+        checkpoint = backfill_location('456', recent_days=30)
+
+    assert mock_list.call_args_list[-2].kwargs['pageToken'] == 'page-2'
+    assert mock_list.call_args_list[-1].kwargs['pageToken'] == 'page-3'
+    assert checkpoint['processed'] == 53
+    assert checkpoint['drafted'] == 4
+    assert checkpoint['done']
+    assert mock_db.batch().commit.call_count == 2
+    mock_pubsub.return_value.publish.assert_called_once()
+
+def test_backfill_skips_reviews_saved_by_regular_ingest(mock_gbp_service, mock_pubsub):
+    """通常の取り込みで保存済みのレビューを上書き・再公開しないテスト"""
+    def make_review(review_id):
+        return {
+            'name': f'accounts/123/locations/456/reviews/{review_id}',
+            'createTime': (datetime.utcnow() - timedelta(days=1)).isoformat(),
+            'reviewer': {'displayName': 'Test User'},
+            'starRating': {'rating': 1},
+            'comment': 'Bad service'
+        }
+
+    mock_gbp_service.accounts().locations().reviews().list.return_value.execute.side_effect = [
+        {'reviews': [make_review('saved'), make_review('unsaved')]}
+    ]
+
+    with patch('src.backend.ingest_lambda.main.db') as mock_db, \
+         patch('src.backend.ingest_lambda.main.aggregates') as mock_aggregates:
+        mock_missing = MagicMock()
+        mock_missing.exists = False
+        mock_db.collection().document().get.return_value = mock_missing
+        mock_db.get_all.return_value = [MagicMock(id='saved', exists=True)]
+
+        checkpoint = backfill_location('456')
+
+    created = [call.args[1] for call in mock_db.batch().create.call_args_list]
+    assert len(created) == 1
+    assert created[0]['status'] == 'new'
+    mock_db.batch().set.assert_not_called()
+    mock_pubsub.return_value.publish.assert_called_once()
+    assert len(mock_aggregates.record_reviews.call_args.args[1]) == 1
+    assert checkpoint['processed'] == 2
+    assert checkpoint['drafted'] == 1
+
+def test_backfill_republishes_page_interrupted_before_publish(mock_gbp_service, mock_pubsub):
+    """保存後・公開前に中断したページを再開時に公開し直すテスト"""
+    def make_review(review_id):
+        return {
+            'name': f'accounts/123/locations/456/reviews/{review_id}',
+            'createTime': (datetime.utcnow() - timedelta(days=1)).isoformat(),
+            'reviewer': {'displayName': 'Test User'},
+            'starRating': {'rating': 1},
+            'comment': 'Bad service'
+        }
+
+    mock_gbp_service.accounts().locations().reviews().list.return_value.execute.side_effect = [
+        {'reviews': [make_review('r1'), make_review('r2'), make_review('r3')]}
+    ]
+
+    with patch('src.backend.ingest_lambda.main.db') as mock_db, \
+         patch('src.backend.ingest_lambda.main.aggregates'):
+        mock_checkpoint = MagicMock()
+        mock_checkpoint.exists = True
+        mock_checkpoint.to_dict.return_value = {
+            'pageToken': 'page-2',
+            'processed': 50,
+            'drafted': 0,
+            'pendingPublish': [
+                'accounts/123/locations/456/reviews/r1',
+                'accounts/123/locations/456/reviews/r2'
+            ],
+            'startedAt': datetime.utcnow(),
+            'done': False
+        }
+        mock_db.collection().document().get.return_value = mock_checkpoint
+        mock_db.get_all.return_value = [MagicMock(id='r1', exists=True), MagicMock(id='r2', exists=True)]
+        published = []
+
+        checkpoint = backfill_location('456', publish=lambda review: published.append(review['name']))
+
+    assert [name.split('/')[-1] for name in published] == ['r1', 'r2', 'r3']
+    assert len(mock_db.batch().create.call_args_list) == 1
+    assert checkpoint['pendingPublish'] == []
+    assert checkpoint['drafted'] == 3
+
+def test_backfill_detects_duplicates(mock_gbp_service, mock_pubsub):
+    """バックフィルでも近似重複のレビューに返信を生成しないテスト"""
+    def make_review(review_id):
+        return {
+            'name': f'accounts/123/locations/456/reviews/{review_id}',
+            'createTime': (datetime.utcnow() - timedelta(days=1)).isoformat(),
+            'reviewer': {'displayName': 'Test User'},
+            'starRating': {'rating': 1},
+            'comment': 'Bad service'
+        }
+
+    mock_gbp_service.accounts().locations().reviews().list.return_value.execute.side_effect = [
+        {'reviews': [make_review('1'), make_review('2')]}
+    ]
+
+    with patch('src.backend.ingest_lambda.main.db') as mock_db, \
+         patch('src.backend.ingest_lambda.main.aggregates'), \
+         patch('src.backend.ingest_lambda.main.detect_duplicate') as mock_detect:
+        mock_missing = MagicMock()
+        mock_missing.exists = False
+        mock_db.collection().document().get.return_value = mock_missing
+        mock_db.get_all.return_value = []
+        mock_detect.side_effect = [None, {'duplicateOf': '1', 'clusterId': '1', 'similarity': 0.9}]
+
+        checkpoint = backfill_location('456')
+
+    created = [call.args[1] for call in mock_db.batch().create.call_args_list]
+    assert [doc['status'] for doc in created] == ['new', 'duplicate']
+    assert created[1]['clusterId'] == '1'
+    mock_pubsub.return_value.publish.assert_called_once()
+    assert checkpoint['drafted'] == 1
+
+def test_main_starts_backfill_for_new_locations(mock_gbp_service, mock_pubsub):
+    """最終取得時刻がないロケーションを通常の取り込みでバックフィルするテスト"""
+    with patch('src.backend.ingest_lambda.main.db') as mock_db, \
+         patch('src.backend.ingest_lambda.main.backfill_location') as mock_backfill:
+        mock_missing = MagicMock()
+        mock_missing.exists = False
+        mock_db.collection().document().get.return_value = mock_missing
+        mock_db.collection().stream.return_value = [MagicMock(id='456')]
+        mock_backfill.return_value = {'processed': 120, 'drafted': 10}
+
+        assert get_backfill_status('456') == 'required'
+        result = main({}, {})
+
+    assert result['message'] == 'Processed 120 reviews'
+    mock_backfill.assert_called_once_with('456')
+    mock_gbp_service.accounts().locations().reviews().list().execute.assert_not_called()
+
+def test_main_skips_locations_with_running_backfill(mock_gbp_service, mock_pubsub):
+    """バックフィル中のロケーションを処理せず、中断したバックフィルは再開するテスト"""
+    with patch('src.backend.ingest_lambda.main.db') as mock_db, \
+         patch('src.backend.ingest_lambda.main.backfill_location') as mock_backfill:
+        mock_checkpoint = MagicMock()
+        mock_checkpoint.exists = True
+        mock_checkpoint.to_dict.return_value = {'done': False, 'updatedAt': datetime.utcnow()}
+        mock_db.collection().document().get.return_value = mock_checkpoint
+        mock_db.collection().stream.return_value = [MagicMock(id='456')]
+
+        result = main({}, {})
+        mock_backfill.assert_not_called()
+
+        mock_checkpoint.to_dict.return_value['updatedAt'] = datetime.utcnow() - timedelta(hours=2)
+        assert get_backfill_status('456') == 'required'
+
+    assert result['status'] == 'success'
+    mock_gbp_service.accounts().locations().reviews().list().execute.assert_not_called()
+    mock_pubsub.return_value.publish.assert_not_called()
+
+def test_main_skips_reviews_saved_by_backfill(mock_gbp_service, mock_pubsub):
+    """バックフィルで保存済みのレビューを通常の取り込みで上書き・再公開しないテスト"""
+    mock_gbp_service.accounts().locations().reviews().list().execute.return_value = {
+        'reviews': [{
+            'name': 'accounts/123/locations/456/reviews/saved',
+            'createTime': datetime.utcnow().isoformat(),
+            'starRating': 'FIVE'
+        }]
+    }
+
+    with patch('src.backend.ingest_lambda.main.db') as mock_db, \
+         patch('src.backend.ingest_lambda.main.get_backfill_status', return_value=None):
+        mock_last_fetch = MagicMock()
+        mock_last_fetch.exists = True
+        mock_last_fetch.to_dict.return_value = {'timestamp': datetime.utcnow() - timedelta(days=1)}
+        mock_db.collection().document().get.return_value = mock_last_fetch
+        mock_db.collection().stream.return_value = [MagicMock(id='456')]
+        mock_db.get_all.return_value = [MagicMock(id='saved', exists=True)]
+
+        result = main({}, {})
+
+    assert result['message'] == 'Processed 0 reviews'
+    mock_db.collection().document().set.assert_called_once()
+    mock_pubsub.return_value.publish.assert_not_called()
+
+def test_build_review_doc_parses_star_rating():
+    """GBP APIの列挙値の星評価を数値で保存するテスト"""
+    review = {
+        'name': 'accounts/123/locations/456/reviews/789',
+        'starRating': 'FOUR',
+        'createTime': datetime.utcnow().isoformat()
+    }
+    assert build_review_doc(review)['rating'] == 4
+    assert build_review_doc({**review, 'starRating': {'rating': 2}})['rating'] == 2
@@ -0,0 +1,143 @@
+import pytest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+from src.backend.common import minhash
+from src.backend.common.minhash import (
+    NUM_PERM,
+    minhash_signature,
+    MinHashIndex,
+    find_duplicate,
+    load_tenant_index,
+    save_tenant_snapshot,
+    get_tenant_index
+)
+
+ORIGINAL = 'スタッフの対応がとても丁寧で、料理も美味しかったです。また家族で来たいと思います！'
+NEAR_DUPLICATE = 'スタッフの対応がとても丁寧で料理も美味しかったです!! また家族で来たいと思います。'
+DIFFERENT = '駐車場が狭くて停めにくかったですが、ランチのパスタは量が多くて満足しました。'
+
+@pytest.fixture
+def mock_firestore():
+    with patch('src.backend.common.minhash.firestore') as mock_firestore:
+        mock_firestore.client().collection().document().get.return_value = MagicMock(exists=False)
+        mock_firestore.client().collection().where().order_by().stream.return_value = []
+        mock_firestore.client().collection().where().where().order_by().stream.return_value = []
+        minhash._indexes.clear()
+        yield mock_firestore
+        minhash._indexes.clear()
+
+def test_minhash_signature():
+    """MinHash署名の作成テスト"""
+    signature = minhash_signature(ORIGINAL)
+    assert len(signature) == NUM_PERM
+    assert signature == minhash_signature(ORIGINAL)
+    assert minhash_signature('美味しかった') is None
+
+def test_index_query():
+    """近似重複の検索テスト"""
+    index = MinHashIndex()
+    index.add('r1', minhash_signature(ORIGINAL))
+    index.add('r2', minhash_signature(DIFFERENT))
+
+    match = index.query(minhash_signature(NEAR_DUPLICATE))
+    assert match is not None
+    assert index.review_ids[match[0]] == 'r1'
+    assert index.query(minhash_signature('店内が清潔で居心地が良く、コーヒーの香りも素晴らしかったです。')) is None
+
+def test_index_from_signatures_matches_incremental():
+    """一括読み込みと逐次追加で同じ検索結果になるテスト"""
+    texts = [ORIGINAL, DIFFERENT]
+    signatures = [minhash_signature(text) for text in texts]
+    flat = [value for signature in signatures for value in signature]
+    index = MinHashIndex.from_signatures(['r1', 'r2'], flat, clusters=[0, 0])
+
+    match = index.query(minhash_signature(NEAR_DUPLICATE))
+    assert index.review_ids[match[0]] == 'r1'
+    assert index.cluster_id(1) == 'r1'
+
+def test_find_duplicate(mock_firestore):
+    """テナント内の重複判定とクラスタリングのテスト"""
+    assert find_duplicate('tenant-1', 'r1', ORIGINAL) is None
+    duplicate = find_duplicate('tenant-1', 'r2', NEAR_DUPLICATE)
+    assert duplicate['duplicateOf'] == 'r1'
+    assert duplicate['clusterId'] == 'r1'
+
+    # 別テナントのレビューとは重複と判定しない
+    assert find_duplicate('tenant-2', 'r3', NEAR_DUPLICATE) is None
+    assert mock_firestore.client().collection().document().set.call_count == 3
+
+def test_find_duplicate_reingest(mock_firestore):
+    """登録済みのレビューを再取り込みしてもインデックスに追加せず同じ判定を返すテスト"""
+    find_duplicate('tenant-1', 'r1', ORIGINAL)
+    first = find_duplicate('tenant-1', 'r2', NEAR_DUPLICATE)
+
+    assert find_duplicate('tenant-1', 'r2', NEAR_DUPLICATE) == first
+    assert find_duplicate('tenant-1', 'r1', ORIGINAL) is None
+    assert len(minhash.get_tenant_index('tenant-1')) == 2
+    assert mock_firestore.client().collection().document().set.call_count == 2
+
+def signature_log(review_id, text, cluster_id, created_at):
+    return MagicMock(id=review_id, to_dict=MagicMock(return_value={
+        'signature': minhash_signature(text).tobytes(),
+        'clusterId': cluster_id,
+        'createdAt': created_at
+    }))
+
+def test_snapshot_round_trip(mock_firestore):
+    """チャンクに保存したインデックスと未圧縮の署名ログからの読み込みテスト"""
+    index = MinHashIndex()
+    index.add('r1', minhash_signature(ORIGINAL))
+    index.add('r2', minhash_signature(NEAR_DUPLICATE), cluster_row=0)
+    index.add('r3', minhash_signature(DIFFERENT))
+
+    chunks = {}
+    index_ref = MagicMock()
+    index_ref.collection().document.side_effect = lambda chunk_id: MagicMock(
+        id=chunk_id, set=lambda data: chunks.__setitem__(chunk_id, data)
+    )
+    compacted_at = datetime(2026, 10, 19)
+    with patch.object(minhash, '_index_ref', return_value=index_ref), \
+            patch.object(minhash, 'CHUNK_SIZE', 2):
+        save_tenant_snapshot('tenant-1', index, [], 0, compacted_at)
+        meta = index_ref.set.call_args.args[0]
+        assert meta['count'] == 3
+        assert len(meta['chunks']) == 2
+
+        # get_allは順不同で返す
+        index_ref.get.return_value = MagicMock(exists=True, to_dict=MagicMock(return_value=meta))
+        mock_firestore.client().get_all.side_effect = lambda refs: [
+            MagicMock(id=ref.id, to_dict=MagicMock(return_value=chunks[ref.id])) for ref in reversed(refs)
+        ]
+        mock_firestore.client().collection().where().where().order_by().stream.return_value = [
+            signature_log('r3', DIFFERENT, 'r3', compacted_at),
+            signature_log('r4', ORIGINAL + '本当に', 'r1', datetime(2026, 10, 20))
+        ]
+        loaded, last_seen = load_tenant_index('tenant-1')
+
+    assert loaded.review_ids == ['r1', 'r2', 'r3', 'r4']
+    assert loaded.cluster_id(1) == 'r1'
+    assert loaded.cluster_id(3) == 'r1'
+    assert loaded.row_of('r3') == 2
+    assert last_seen == datetime(2026, 10, 20)
+    assert index_ref.set.call_count == 1
+
+def test_tenant_index_refresh_and_eviction(mock_firestore):
+    """キャッシュしたインデックスへの追加分の取り込みと、キャッシュ上限のテスト"""
+    logs = mock_firestore.client().collection().where().order_by().stream
+    logs.return_value = [signature_log('r1', ORIGINAL, 'r1', datetime(2026, 10, 19))]
+    with patch.object(minhash.time, 'time', return_value=1000.0) as now, \
+            patch.object(minhash, 'MAX_CACHED_TENANTS', 1):
+        index = get_tenant_index('tenant-1')
+        assert index.review_ids == ['r1']
+
+        # 他のインスタンスが登録した署名を一定時間後に取り込む
+        mock_firestore.client().collection().where().where().order_by().stream.return_value = [
+            signature_log('r2', DIFFERENT, 'r2', datetime(2026, 10, 20))
+        ]
+        assert len(get_tenant_index('tenant-1')) == 1
+        now.return_value += minhash.REFRESH_SECONDS + 1
+        assert get_tenant_index('tenant-1') is index
+        assert index.review_ids == ['r1', 'r2']
+
+        get_tenant_index('tenant-2')
+        assert list(minhash._indexes) == ['tenant-2']
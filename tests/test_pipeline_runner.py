@@ -0,0 +1,142 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+from datetime import datetime
+from src.backend.pipeline_runner.main import run_pipeline
+
+def make_review(review_id, location_id='456'):
+    return {
+        'name': f'accounts/123/locations/{location_id}/reviews/{review_id}',
+        'createTime': datetime.utcnow().isoformat(),
+        'reviewer': {'displayName': 'Test User'},
+        'starRating': {'rating': 5},
+        'comment': 'Great service!'
+    }
+
+@pytest.fixture
+def mock_stages():
+    with patch('src.backend.ingest_lambda.main.get_new_reviews') as mock_get_new_reviews, \
+         patch('src.backend.ingest_lambda.main.filter_unsaved_reviews') as mock_filter_unsaved, \
+         patch('src.backend.ingest_lambda.main.save_review_to_firestore') as mock_save_review, \
+         patch('src.backend.ingest_lambda.main.get_tenant_id') as mock_get_tenant_id, \
+         patch('src.backend.ingest_lambda.main.detect_duplicate') as mock_detect_duplicate, \
+         patch('src.backend.ingest_lambda.main.update_last_fetch') as mock_update_last_fetch, \
+         patch('src.backend.ingest_lambda.main.get_backfill_status') as mock_backfill_status, \
+         patch('src.backend.generate_lambda.main.process_review') as mock_process_review, \
+         patch('src.backend.push_lambda.main.send_review_notification') as mock_send, \
+         patch('src.backend.common.aggregates.rollup_location_stats') as mock_rollup:
+        mock_get_new_reviews.side_effect = lambda location_id: [
+            make_review(f'{location_id}-{i}', location_id) for i in range(5)
+        ]
+        mock_process_review.side_effect = lambda review_id, location_id, review: f'draft-{review_id}'
+        mock_filter_unsaved.side_effect = lambda reviews: reviews
+        mock_get_tenant_id.return_value = 'tenant-1'
+        mock_detect_duplicate.return_value = None
+        mock_backfill_status.return_value = None
+        mock_send.return_value = True
+        yield {
+            'get_new_reviews': mock_get_new_reviews,
+            'filter_unsaved': mock_filter_unsaved,
+            'save_review': mock_save_review,
+            'update_last_fetch': mock_update_last_fetch,
+            'backfill_status': mock_backfill_status,
+            'detect_duplicate': mock_detect_duplicate,
+            'process_review': mock_process_review,
+            'send': mock_send,
+            'rollup': mock_rollup
+        }
+
+def test_run_pipeline(mock_stages):
+    """全ステージを通してレビューが処理されるテスト"""
+    result = asyncio.run(run_pipeline(
+        location_ids=['456', '789'],
+        ingest_concurrency=2,
+        generate_concurrency=3,
+        push_concurrency=2,
+        queue_size=2
+    ))
+
+    assert result['status'] == 'success'
+    assert result['ingested'] == 10
+    assert result['drafted'] == 10
+    assert result['pushed'] == 10
+    assert result['failed'] == 0
+    assert mock_stages['update_last_fetch'].call_count == 2
+    mock_stages['send'].assert_any_call('456-0', 'draft-456-0')
+    assert mock_stages['rollup'].call_count == 2
+
+def test_run_pipeline_continues_after_failure(mock_stages):
+    """1件の生成失敗でパイプライン全体が止まらないテスト"""
+    def process_review(review_id, location_id, review):
+        if review_id == '456-2':
+            raise RuntimeError('OpenAI error')
+        return f'draft-{review_id}'
+    mock_stages['process_review'].side_effect = process_review
+
+    result = asyncio.run(run_pipeline(location_ids=['456'], queue_size=1))
+
+    assert result['drafted'] == 4
+    assert result['pushed'] == 4
+    assert result['failed'] == 1
+
+def test_run_pipeline_skips_duplicates(mock_stages):
+    """近似重複レビューが生成・通知されないテスト"""
+    mock_stages['detect_duplicate'].side_effect = lambda tenant_id, review: (
+        {'duplicateOf': '456-0', 'clusterId': '456-0', 'similarity': 0.9}
+        if not review['name'].endswith('/456-0') else None
+    )
+
+    result = asyncio.run(run_pipeline(location_ids=['456']))
+
+    assert result['duplicates'] == 4
+    assert result['drafted'] == 1
+    assert result['pushed'] == 1
+    assert mock_stages['save_review'].call_count == 5
+
+def test_run_pipeline_backfills_new_locations(mock_stages):
+    """新しいロケーションはバックフィルし、バックフィル中のロケーションは処理しないテスト"""
+    mock_stages['backfill_status'].side_effect = lambda location_id: {
+        '789': 'running', '999': 'required'
+    }.get(location_id)
+
+    with patch('src.backend.ingest_lambda.main.backfill_location') as mock_backfill:
+        mock_backfill.side_effect = lambda location_id, **kwargs: kwargs['publish'](
+            make_review(f'{location_id}-0', location_id)
+        )
+        result = asyncio.run(run_pipeline(location_ids=['456', '789', '999']))
+
+    assert result['ingested'] == 6
+    mock_stages['get_new_reviews'].assert_called_once_with('456')
+    assert mock_backfill.call_args.args == ('999',)
+
+def test_run_pipeline_backfill(mock_stages):
+    """バックフィルのドラフト生成対象をPub/Subではなくプロセス内のキューで処理するテスト"""
+    def backfill_location(location_id, recent_days=None, unanswered_only=True, publish=None):
+        for i in range(3):
+            publish(make_review(f'{location_id}-{i}', location_id))
+        return {'processed': 3, 'drafted': 3}
+
+    with patch('src.backend.ingest_lambda.main.backfill_location') as mock_backfill, \
+         patch('src.backend.ingest_lambda.main.publish_to_pubsub') as mock_publish:
+        mock_backfill.side_effect = backfill_location
+        result = asyncio.run(run_pipeline(
+            location_ids=['456'],
+            queue_size=1,
+            backfill_options={'recent_days': 30, 'unanswered_only': True}
+        ))
+
+    assert mock_backfill.call_args.kwargs['recent_days'] == 30
+    mock_publish.assert_not_called()
+    mock_stages['get_new_reviews'].assert_not_called()
+    assert result['ingested'] == 3
+    assert result['pushed'] == 3
+
+def test_run_pipeline_skips_saved_reviews(mock_stages):
+    """バックフィルで保存済みのレビューを再保存・再生成しないテスト"""
+    mock_stages['filter_unsaved'].side_effect = lambda reviews: reviews[2:]
+
+    result = asyncio.run(run_pipeline(location_ids=['456']))
+
+    assert result['ingested'] == 3
+    assert mock_stages['save_review'].call_count == 3
+    assert mock_stages['process_review'].call_count == 3
@@ -0,0 +1,131 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from src.backend.common.priority import (
+    classify_review,
+    LaneScheduler,
+    drain_lanes,
+    topic_name
+)
+from src.backend.common import priority
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_classify_review():
+    """優先レーン判定のテスト"""
+    assert classify_review({'rating': 1, 'comment': ''}) == 'urgent'
+    assert classify_review({'rating': 3, 'comment': '店員が失礼でした'}) == 'urgent'
+    assert classify_review({'rating': 5, 'comment': '返金してもらえました'}) == 'normal'
+    assert classify_review({'rating': 3, 'comment': '普通です'}) == 'normal'
+    assert classify_review({'rating': None, 'comment': ''}) == 'normal'
+    assert classify_review({'rating': 5, 'comment': 'Great service!'}) == 'low'
+
+def test_scheduler_weighted_order():
+    """重み付き公平スケジューリングのテスト"""
+    clock = FakeClock()
+    scheduler = LaneScheduler(clock=clock)
+    for i in range(10):
+        scheduler.push('low', f'low-{i}')
+        scheduler.push('urgent', f'urgent-{i}')
+
+    lanes = [scheduler.pop()[0] for _ in range(7)]
+    assert lanes.count('urgent') == 6
+    assert lanes.count('low') == 1
+    assert lanes[0] == 'urgent'
+
+def test_scheduler_starvation_protection():
+    """待ち時間の上限を超えたレーンが優先されるテスト"""
+    clock = FakeClock()
+    scheduler = LaneScheduler(max_wait=60, clock=clock)
+    scheduler.push('low', 'old-low', enqueued_at=clock.now - 120)
+    for i in range(5):
+        scheduler.push('urgent', f'urgent-{i}')
+
+    lane, item, _ = scheduler.pop()
+    assert (lane, item) == ('low', 'old-low')
+
+def test_scheduler_aging_keeps_urgent_share():
+    """全レーンが待ち時間の上限を超えていても緊急レーンの取り出し順を後回しにしないテスト"""
+    clock = FakeClock()
+    scheduler = LaneScheduler(max_wait=60, clock=clock)
+    for i in range(4):
+        scheduler.push('low', f'low-{i}', enqueued_at=clock.now - 300 + i)
+    for i in range(4):
+        scheduler.push('normal', f'normal-{i}', enqueued_at=clock.now - 200 + i)
+    for i in range(6):
+        scheduler.push('urgent', f'urgent-{i}', enqueued_at=clock.now - 100 + i)
+
+    lanes = [scheduler.pop()[0] for _ in range(10)]
+
+    # 最も古い低優先レーンが先に順番を得るが、緊急レーンは重みどおりの割合で取り出される
+    assert lanes[0] == 'low'
+    assert lanes[1] == 'urgent'
+    assert lanes.count('urgent') >= 5
+    # 下位レーンの順番は待ち時間の長い順
+    assert [lane for lane in lanes if lane != 'urgent'][:4] == ['low'] * 4
+
+def test_scheduler_metrics():
+    """レーンごとの待ち時間計測のテスト"""
+    clock = FakeClock()
+    scheduler = LaneScheduler(clock=clock)
+    scheduler.push('urgent', 'a', enqueued_at=clock.now - 10)
+    scheduler.push('urgent', 'b', enqueued_at=clock.now - 30)
+    while len(scheduler):
+        lane, _, enqueued_at = scheduler.pop()
+        scheduler.record_latency(lane, enqueued_at)
+
+    metrics = scheduler.metrics()
+    assert metrics['urgent']['count'] == 2
+    assert metrics['urgent']['avg_latency'] == pytest.approx(20)
+    assert metrics['urgent']['max_latency'] == pytest.approx(30)
+    assert metrics['low']['count'] == 0
+
+def test_topic_name():
+    """レーン無効時は従来のトピックに公開するテスト"""
+    with patch.object(priority, 'LANES_ENABLED', False):
+        assert topic_name('review-queue', 'urgent') == 'review-queue'
+    with patch.object(priority, 'LANES_ENABLED', True):
+        assert topic_name('review-queue', 'urgent') == 'review-queue-urgent'
+
+def test_drain_lanes():
+    """レーンからの取得・処理・ACKと、空きレーンの残り枠の再配分のテスト"""
+    backlog = {'generate-urgent': 8, 'generate-normal': 0, 'generate-low': 5}
+
+    def pull(request):
+        subscription = request['subscription']
+        count = min(request['max_messages'], backlog[subscription])
+        backlog[subscription] -= count
+        received_messages = []
+        for i in range(count):
+            received = MagicMock(ack_id=f'{subscription}-{backlog[subscription] + i}')
+            received.message.attributes = {'queued_at': '1000.0'}
+            received_messages.append(received)
+        return MagicMock(received_messages=received_messages)
+
+    with patch('src.backend.common.priority.pubsub_v1.SubscriberClient') as mock_subscriber:
+        subscriber = mock_subscriber.return_value
+        subscriber.subscription_path.side_effect = lambda project, name: name
+        subscriber.pull.side_effect = pull
+        handler = MagicMock(side_effect=[None, RuntimeError('failed')] + [None] * 8)
+
+        with patch.dict('os.environ', {'GOOGLE_CLOUD_PROJECT': 'test-project'}):
+            metrics = drain_lanes(
+                'generate', handler, batch_size=10, scheduler=LaneScheduler(clock=FakeClock(1005.0))
+            )
+
+    # 通常レーンが空の分は緊急・低優先レーンから追加で取得する
+    assert backlog == {'generate-urgent': 0, 'generate-normal': 0, 'generate-low': 3}
+    assert handler.call_count == 10
+    assert subscriber.acknowledge.call_count == 9
+    assert metrics['urgent']['count'] + metrics['low']['count'] == 9
+    assert metrics['urgent']['max_latency'] == pytest.approx(5)
+
+    # 処理前にACK期限を延長し、失敗したメッセージは期限を0にして再配信させる
+    deadlines = [call.kwargs['request'] for call in subscriber.modify_ack_deadline.call_args_list]
+    assert deadlines[0]['ack_deadline_seconds'] == priority.ACK_DEADLINE_SECONDS
+    assert deadlines[-1]['ack_deadline_seconds'] == 0
+    assert len(deadlines[-1]['ack_ids']) == 1
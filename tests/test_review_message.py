@@ -0,0 +1,69 @@
+import json
+import pytest
+from datetime import datetime
+from src.backend.common.review_message import (
+    parse_rating,
+    encode_review,
+    decode_review
+)
+
+@pytest.fixture
+def gbp_review():
+    return {
+        'name': 'accounts/123/locations/456/reviews/789',
+        'createTime': datetime.utcnow().isoformat(),
+        'updateTime': datetime.utcnow().isoformat(),
+        'reviewer': {
+            'displayName': 'Test User',
+            'profilePhotoUrl': 'https://example.com/photo.jpg'
+        },
+        'starRating': 'FOUR',
+        'comment': 'Great service!'
+    }
+
+def test_parse_rating():
+    """星評価の変換テスト"""
+    assert parse_rating('FIVE') == 5
+    assert parse_rating({'rating': 3}) == 3
+    assert parse_rating('2') == 2
+    assert parse_rating('STAR_RATING_UNSPECIFIED') is None
+    assert parse_rating(None) is None
+
+def test_encode_decode_compact(gbp_review):
+    """コンパクト形式のエンコード・デコードテスト"""
+    data, attributes = encode_review(gbp_review, version=2)
+
+    assert attributes == {'schema': 'review', 'schema_version': '2'}
+    assert len(data) < len(json.dumps(gbp_review).encode('utf-8'))
+
+    review = decode_review(data, attributes)
+    assert review['review_id'] == '789'
+    assert review['location_id'] == '456'
+    assert review['rating'] == 4
+    assert review['author'] == 'Test User'
+    assert review['comment'] == 'Great service!'
+
+def test_encode_compresses_long_comment(gbp_review):
+    """長いコメントの圧縮テスト"""
+    gbp_review['comment'] = 'とても美味しかったです。' * 100
+    data, attributes = encode_review(gbp_review, version=2)
+
+    assert 'cz' in json.loads(data)
+    assert len(data) < len(gbp_review['comment'].encode('utf-8'))
+    assert decode_review(data, attributes)['comment'] == gbp_review['comment']
+
+def test_decode_legacy_message(gbp_review):
+    """属性のない従来形式メッセージのデコードテスト"""
+    review = decode_review(json.dumps(gbp_review).encode('utf-8'))
+    assert review['review_id'] == '789'
+    assert review['location_id'] == '456'
+    assert review['rating'] == 4
+
+def test_decode_rejects_unknown_schema(gbp_review):
+    """未登録スキーマの拒否テスト"""
+    data, _ = encode_review(gbp_review, version=2)
+
+    with pytest.raises(ValueError):
+        decode_review(data, {'schema': 'review', 'schema_version': '99'})
+    with pytest.raises(ValueError):
+        decode_review(data, {'schema': 'draft', 'schema_version': '2'})